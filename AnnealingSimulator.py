@@ -1,13 +1,19 @@
+import multiprocessing
 import numpy as np
 from SkewedSlicingTree import SkewedSlicingTree
 from NormPolishExpression import NormPolishExpression
 from SlicingTreeSolutionCache import SlicingTreeSolutionCache
+from SubtreeShapeCache import SubtreeShapeCache
+from SoftModuleInfo import SoftModuleInfo
 import math
-import copy
+import time
 import warnings
 import enum
-from Utilities import LOG
-import statistics
+from Utilities import LOG, isLogEnabled
+from TraceEventSink import TraceEventSink
+from PhaseProfiler import PhaseProfiler
+from OnlineStatistics import OnlineStatistics
+from WorkerContext import WorkerContext
 from Parameters import Parameters
 
 
@@ -18,7 +24,9 @@ class AnnealingSimulator:
         NeighborsRejectRateTooHigh = 1
         MaxAnnealCountReached = 2
         ToHighHitCacheRate = 3
-        EndOfReason = 4
+        TimeBudgetExhausted = 4
+        EvaluationBudgetExhausted = 5
+        EndOfReason = 6  # always to the last item
 
     class PerturbOperation(enum.Enum):
         SwapTwoAdjacentOperands = 0
@@ -28,22 +36,6 @@ class AnnealingSimulator:
 
     DefaultDeltaAvg = 20
 
-    @staticmethod
-    def _randomlySwapTwoAdjacentOperands(expression):
-        return expression.randomlySwapTwoAdjacentOperands()
-
-    @staticmethod
-    def _InvertChain(expression):
-        return expression.randomlyInvertChain()
-
-    @staticmethod
-    def _testSwapTwoAdjacentOperandOperator(expression):
-        return expression.testSwapTwoAdjacentOperandOperator()
-
-    @staticmethod
-    def _testSwapTwoAdjacentOperatorAndOperand(expression):
-        return expression.testSwapTwoAdjacentOperatorAndOperand()
-
     def _satisfyFeatureSpecificConstraints(self, expression):
         return True  # todo: add feature more feature specific constrains
 
@@ -72,34 +64,56 @@ class AnnealingSimulator:
         self._maxAnnealingCount = 10
         self._maxNumPerturbToEstDeltaAvg = 500
         self._preferredNumOfPosUphillToEstDeltaAvg = 10
+        self._toEstimateDeltaAvg = True
+        self._targetAcceptRatio = None  # None: fixed cooling rate and iterations per temperature
+        self._maxNumIterationPerTemperature = None
+        self._numOfTreeEvaluations = 0
+        self._numOfMetropolisTrials = 0  # solvable neighbors judged by the Metropolis rule
+        self._numOfMetropolisAccepts = 0
+        self._numOfNeighborEvaluations = 0  # neighbors evaluated, valid or not
+        self._timeBudget = None  # seconds from the start of runSimulation()
+        self._deadline = None  # time.monotonic() value
+        self._maxNumOfNeighborEvaluations = None
+        self._stopTime = None  # the earlier of deadline and the end of the time budget, set by runSimulation()
+        self._exhaustedBudget = None  # TerminateReason of the budget that stopped the run
+        self._improvementCallback = None
 
         self._randomSeed = 100
 
-        self._delaySamples = []
-        self._delayEvaluationsSamples = []
-        self._delayToCacheSamples = []
+        self._delayStatistics = OnlineStatistics(Parameters.delaySampleReservoirSize, self._randomSeed)
+        self._delayEvaluationsStatistics = OnlineStatistics()
+        self._delayToCacheStatistics = OnlineStatistics()
         self._cacheHitRate = 0
+        self._traceSink = None
+        self._numOfCandidatesPerStep = 1
+        self._numOfCandidateProcesses = 1
+        self._candidatePool = None  # open during runSimulation() when candidates are evaluated by worker processes
 
     def appendToCacheSamples(self, sample):
-        self._delayToCacheSamples.append(sample)
+        self._delayToCacheStatistics.add(sample)
 
     def appendtoEvaluationSamples(self, sample):
-        self._delayEvaluationsSamples.append(sample)
+        self._delayEvaluationsStatistics.add(sample)
 
     def appendDelaySample(self, sample):
-        self._delaySamples.append(sample)
+        self._delayStatistics.add(sample)
+
+    def delayStatistics(self):  # OnlineStatistics of the delays of the solvable neighbors
+        return self._delayStatistics
 
     def solutionResult(self):
         return {"bestExpression": self._bestExpression,
                 "bestShapes": self._bestShapeSolution,
                 "minimumDelay": self._minimumDelay,
-                "delayMean": 0 if len(self._delaySamples) < 1 else statistics.mean(self._delaySamples),
-                "delayStdVariance": 0 if len(self._delaySamples) < 2 else math.sqrt(
-                    statistics.variance(self._delaySamples)),
-                "delayMin": 0 if len(self._delaySamples) < 1 else min(self._delaySamples),
-                "delayMax": 0 if len(self._delaySamples) < 1 else max(self._delaySamples),
+                "delayMean": 0 if self._delayStatistics.count < 1 else self._delayStatistics.mean,
+                "delayStdVariance": 0 if self._delayStatistics.count < 2 else self._delayStatistics.stdDeviation(),
+                "delayMin": 0 if self._delayStatistics.count < 1 else self._delayStatistics.min,
+                "delayMax": 0 if self._delayStatistics.count < 1 else self._delayStatistics.max,
                 "cacheHitRate": self._cacheHitRate,
-                "terminateReason": self._terminateReason.value}
+                "terminateReason": self._terminateReason.value,
+                "numOfTreeEvaluations": self._numOfTreeEvaluations,
+                "numOfNeighborEvaluations": self._numOfNeighborEvaluations,
+                "profile": PhaseProfiler.report() if Parameters.toProfilePhases else None}
 
     def die(self):
         return np.random.random()
@@ -117,6 +131,32 @@ class AnnealingSimulator:
     def setPreferredNumOfPosUphillToEstDeltaAvg(self, num):
         self._preferredNumOfPosUphillToEstDeltaAvg = num
 
+    def setToEstimateDeltaAvg(self, toEstimate):  # False: start temperature from DefaultDeltaAvg
+        self._toEstimateDeltaAvg = toEstimate
+
+    def setAdaptiveSchedule(self, targetAcceptRatio, maxNumIterationPerTemperature=None):
+        # Targets the Metropolis acceptance ratio of the solvable neighbors: a temperature that accepted more than
+        # targetAcceptRatio of them cools at the annealing rate squared and the next one runs
+        # numIterationPerTemperature * targetAcceptRatio / acceptRatio iterations, at most
+        # maxNumIterationPerTemperature (None: numIterationPerTemperature, so that only the hot stages shorten).
+        # targetAcceptRatio None restores the fixed schedule.
+        self._targetAcceptRatio = targetAcceptRatio
+        self._maxNumIterationPerTemperature = maxNumIterationPerTemperature
+
+    def setTimeBudget(self, seconds):  # stop after seconds of runSimulation(), None: no time budget
+        self._timeBudget = seconds
+
+    def setDeadline(self, deadline):  # stop at a time.monotonic() value, None: no deadline
+        self._deadline = deadline
+
+    def setMaxNumOfNeighborEvaluations(self, num):  # stop after num evaluated neighbors, None: no evaluation budget
+        self._maxNumOfNeighborEvaluations = num
+
+    def setImprovementCallback(self, callback):
+        # callback(minimumDelay, bestExpression, bestShapes) whenever the best solution improves, None: no callback.
+        # bestExpression is a copy that the simulator does not change afterwards.
+        self._improvementCallback = callback
+
     def setMaxAnnealingCount(self, count):
         self._maxAnnealingCount = count
 
@@ -142,176 +182,449 @@ class AnnealingSimulator:
         numOfTask = self._startExpression.numOfTask()
         return (2 + 2 * numOfTask) / 2 * numOfTask  # heuristically 2 + 4 + 8 + ... + 2 * #numOfTask
 
+    def setTraceSink(self, sink):  # a TraceEventSink that receives one event per iteration, None: no tracing
+        self._traceSink = sink
+
+    def setNumOfCandidatesPerStep(self, num):  # > 1: each step evaluates num moves and selects one, see _annealBatch()
+        self._numOfCandidatesPerStep = num
+
+    def setNumOfCandidateProcesses(self, num):  # > 1: the candidates of a step are evaluated by a process pool
+        self._numOfCandidateProcesses = num
+
     def setStartExpression(self, startExpr):
         self._startExpression = NormPolishExpression(startExpr)  # Todo: to check start expression
 
-    def _findNeighborExpression(self, currentExpression):
+    def _findNeighborMove(self, currentExpression):
         operation = self.selectOperation()
-        if operation is AnnealingSimulator.PerturbOperation.SwapTwoAdjacentOperands:
-            neighborExpression = AnnealingSimulator._randomlySwapTwoAdjacentOperands(currentExpression)
-        elif operation is AnnealingSimulator.PerturbOperation.InvertChain:
-            neighborExpression = AnnealingSimulator._InvertChain(currentExpression)
-        elif operation is AnnealingSimulator.PerturbOperation.SwapTwoAdjacentOperandsOperators:
+        if operation is AnnealingSimulator.PerturbOperation.SwapTwoAdjacentOperandsOperators:
+            move = currentExpression.sampleSwapTwoAdjacentOperandsOperators()
+            if move is not None:
+                return move
             # for a special case, 01F2F3F4F..., it has no neighbors by swapping two adjacent operand and operators
-            if currentExpression.isFullUnqiueExpression():
-                LOG('full unqiue expression found, {}'.format(currentExpression.getExpressionInfoCompactFormat()), 0)
-                # try another operation
-                return self._findNeighborExpression(currentExpression)
+            LOG(lambda: 'no valid operand/operator swap, {}'.format(currentExpression.getExpressionInfoCompactFormat()),
+                0)
+            operation = AnnealingSimulator.PerturbOperation(np.random.randint(
+                low=0, high=AnnealingSimulator.PerturbOperation.SwapTwoAdjacentOperandsOperators.value))
+        if operation is AnnealingSimulator.PerturbOperation.SwapTwoAdjacentOperands:
+            return currentExpression.sampleSwapTwoAdjacentOperands()
+        return currentExpression.sampleInvertChain()
+
+    def _updateBest(self, delay, bestShapes, bestExpression):  # bestExpression is kept, shapes are immutable
+        self._minimumDelay = delay
+        self._bestShapeSolution = bestShapes
+        self._bestExpression = bestExpression
+        if self._improvementCallback is not None:
+            self._improvementCallback(delay, bestExpression, bestShapes)
+
+    def _hasBudget(self):
+        return self._stopTime is not None or self._maxNumOfNeighborEvaluations is not None
+
+    def _checkBudgets(self):
+        # True, with the exhausted budget recorded, once the stop time has passed or the evaluation budget is used up
+        if self._stopTime is not None and time.monotonic() >= self._stopTime:
+            self._exhaustedBudget = AnnealingSimulator.TerminateReason.TimeBudgetExhausted
+        elif self._maxNumOfNeighborEvaluations is not None \
+                and self._numOfNeighborEvaluations >= self._maxNumOfNeighborEvaluations:
+            self._exhaustedBudget = AnnealingSimulator.TerminateReason.EvaluationBudgetExhausted
+        return self._exhaustedBudget is not None
+
+    def _estimateDeltaAvg(self):
+        # Average uphill delay change between successive solvable expressions of a random walk from the start
+        # expression (every move accepted), None if the walk saw no uphill change. Improvements found on the way are
+        # kept as the best solution.
+        expression = self._startExpression.copy()
+        previousDelay = None
+        uphillDeltas = []
+        hasBudget = self._hasBudget()
+        for perturbCount in range(self._maxNumPerturbToEstDeltaAvg):
+            if hasBudget and self._checkBudgets():
+                break
+            expression.applyMove(self._findNeighborMove(expression))
+            (foundValid, hitCache, delay, bestShapes) = self._evaluateCandidate(expression)
+            self._numOfNeighborEvaluations = self._numOfNeighborEvaluations + 1
+            if foundValid:
+                self._numOfTreeEvaluations = self._numOfTreeEvaluations + 1
+            if math.isnan(delay):
+                continue
+            if delay < self._minimumDelay:
+                self._updateBest(delay, bestShapes, expression.copy())
+            if previousDelay is not None and delay > previousDelay:
+                uphillDeltas.append(delay - previousDelay)
+                if len(uphillDeltas) >= self._preferredNumOfPosUphillToEstDeltaAvg:
+                    break
+            previousDelay = delay
+        if len(uphillDeltas) == 0:
+            return None
+        return 1.0 * sum(uphillDeltas) / len(uphillDeltas)
+
+    def _drawCandidateMoves(self, currentExpression):
+        # up to numOfCandidatesPerStep distinct moves from currentExpression
+        moves = []
+        for attempt in range(2 * self._numOfCandidatesPerStep):
+            move = self._findNeighborMove(currentExpression)
+            if move not in moves:
+                moves.append(move)
+                if len(moves) == self._numOfCandidatesPerStep:
+                    break
+        return moves
+
+    def _evaluateCandidate(self, expression):
+        # (foundValid, hitCache, delay, bestShapes) of an expression, delay is nan if it is not solvable
+        if not self._satisfyFeatureSpecificConstraints(expression):
+            return (False, False, math.nan, None)
+        slicingTree = SkewedSlicingTree(expression)
+        if not slicingTree.satisfyFeatureSpecificConstraints(Parameters.featureConstrain):
+            return (False, False, math.nan, None)
+        slicingTree.evaluate()
+        if not slicingTree.isSolvable():
+            return (True, slicingTree.hitCache(), math.nan, None)
+        return (True, slicingTree.hitCache(), slicingTree.getMinimumDelay(), slicingTree.getBestShapeSolution())
+
+    @staticmethod
+    def _evaluateCandidateInWorker(expressionTags):
+        # runs in a worker of the candidate pool, against the caches of that worker
+        return AnnealingSimulator()._evaluateCandidate(NormPolishExpression(expressionTags))
+
+    def _evaluateCandidates(self, currentExpression, moves):
+        # evaluations of the neighbors by moves, in order; each neighbor that improves the best solution is recorded
+        # (also the ones that are not selected afterwards). Neighbors of one step share most of their subtrees, which
+        # the subtree memo evaluates once.
+        if self._candidatePool is None:
+            evaluations = []
+            for move in moves:
+                currentExpression.applyMove(move)
+                evaluation = self._evaluateCandidate(currentExpression)
+                if evaluation[2] < self._minimumDelay:
+                    self._updateBest(evaluation[2], evaluation[3], currentExpression.copy())
+                currentExpression.undoMove(move)
+                evaluations.append(evaluation)
+        else:
+            candidates = []
+            for move in moves:
+                currentExpression.applyMove(move)
+                candidates.append(list(currentExpression))
+                currentExpression.undoMove(move)
+            evaluations = self._candidatePool.map(AnnealingSimulator._evaluateCandidateInWorker, candidates)
+            for (evaluation, expressionTags) in zip(evaluations, candidates):
+                if evaluation[2] < self._minimumDelay:
+                    self._updateBest(evaluation[2], evaluation[3], NormPolishExpression(expressionTags))
+        for evaluation in evaluations:
+            if not math.isnan(evaluation[2]):
+                self.appendDelaySample(evaluation[2])
+        return evaluations
+
+    def _annealBatch(self, currentExpression, currentDelay, temperature, numOfIterations, annealingCounts):
+        # _anneal() with numOfCandidatesPerStep neighbors per step. One of the solvable neighbors is selected with
+        # probability proportional to exp(-delay / temperature) and then accepted by the Metropolis rule against
+        # currentDelay. Without a solvable neighbor the first one goes through the acceptance rules of _anneal() for
+        # unsolvable and invalid neighbors. A step counts as one iteration and, rejected, as one reject.
+        reject = 0
+        hitCacheCount = 0
+        numOfTreeEvaluate = 0
+        traceSink = self._traceSink
+        hasBudget = self._hasBudget()
+        for iterCount in range(numOfIterations):
+            if hasBudget and self._checkBudgets():
+                break
+            moves = self._drawCandidateMoves(currentExpression)
+            evaluations = self._evaluateCandidates(currentExpression, moves)
+            self._numOfNeighborEvaluations = self._numOfNeighborEvaluations + len(moves)
+            for (foundValid, hitCache, delay, bestShapes) in evaluations:
+                if foundValid:
+                    numOfTreeEvaluate = numOfTreeEvaluate + 1
+                    hitCacheCount = hitCacheCount + hitCache
+
+            solvables = [index for (index, evaluation) in enumerate(evaluations) if not math.isnan(evaluation[2])]
+            if len(solvables) > 0:
+                delays = np.array([evaluations[index][2] for index in solvables])
+                weights = np.exp(-(delays - delays.min()) / temperature)
+                position = int(np.searchsorted(np.cumsum(weights), self.die() * weights.sum(), side='right'))
+                selected = solvables[min(position, len(solvables) - 1)]
+                neighborDelay = evaluations[selected][2]
+                deltaDelay = neighborDelay - currentDelay
+                accepted = deltaDelay <= 0 or self.die() < math.exp(-deltaDelay / temperature)
+                self._numOfMetropolisTrials = self._numOfMetropolisTrials + 1
+                if accepted:
+                    self._numOfMetropolisAccepts = self._numOfMetropolisAccepts + 1
+                    currentDelay = neighborDelay
+                outcome = TraceEventSink.Outcome.Accepted if accepted else TraceEventSink.Outcome.Rejected
             else:
-                done = False
-                MAXLOOP = 100
-                countLoop = 0
-                while (not done) and (countLoop < MAXLOOP):
-                    countLoop = countLoop + 1
-                    (done, neighborExpression) = AnnealingSimulator._testSwapTwoAdjacentOperandOperator(
-                        currentExpression)
-                    if not done:
-                        (done, neighborExpression) = AnnealingSimulator._testSwapTwoAdjacentOperatorAndOperand(
-                            currentExpression)
-
-                if countLoop >= MAXLOOP:
-                    LOG(
-                        'Max Loop reached when searching for neighbors by swap operand/operator for expression = {}'.format(
-                            currentExpression.getExpressionInfoCompactFormat()), 1)
-                    # try another operation
-                    return self._findNeighborExpression(currentExpression)
-
-        return self._satisfyFeatureSpecificConstraints(neighborExpression), neighborExpression
+                selected = 0
+                neighborDelay = math.nan
+                foundValid = evaluations[selected][0]
+                accepted = self.die() < (self._acceptNonSolvableProb if foundValid
+                                         else self._acceptNotSatisfiedConstraintProb)
+                if accepted:
+                    currentDelay = self.getHeuristicDelay()
+                if foundValid:
+                    outcome = TraceEventSink.Outcome.UnsolvableAccepted if accepted \
+                        else TraceEventSink.Outcome.UnsolvableRejected
+                else:
+                    outcome = TraceEventSink.Outcome.InvalidAccepted if accepted \
+                        else TraceEventSink.Outcome.InvalidRejected
 
-    def runSimulation(self):
-        currentExpression = self._startExpression
-        currentDelay = self._minimumDelay
-        temperature = -self._deltaAvg / math.log(self._initProbabilityToAcceptUphill)
-        annealingCounts = 0
-        SlicingTreeSolutionCache.reset()
-
-        while True:
-            continueAnnealing = True
-            reject = 0
-            hitCacheCount = 0
-            numOfTreeEvaluate = 0
-            for iterCount in range(self._numIterationPerTemperature):
-                foundValid = False
-                slicingTree = None
-                (foundNeighbor, neighborExpression) = self._findNeighborExpression(currentExpression)
+            move = moves[selected]
+            if accepted:
+                currentExpression.applyMove(move)
+            else:
+                reject = reject + 1
+            LOG(lambda: "[{}-{}] {} candidates, selected {} {}, delay {}, current {:.2f}, best {:.2f}, T:{:.2f}".format(
+                annealingCounts, iterCount, len(moves), move, outcome.name, neighborDelay, currentDelay,
+                self._minimumDelay, temperature), 0)
+            if traceSink is not None:
+                traceSink.record(annealingCounts, iterCount, move.operation.value, move.index, outcome.value,
+                                 evaluations[selected][1], neighborDelay, currentDelay, self._minimumDelay,
+                                 temperature)
+
+        return currentDelay, reject, hitCacheCount, numOfTreeEvaluate
+
+    def _anneal(self, currentExpression, currentDelay, temperature, numOfIterations, annealingCounts=0):
+        # numOfIterations Metropolis steps at a fixed temperature, perturbing currentExpression in place and
+        # updating the best solution; returns (currentDelay, reject, hitCacheCount, numOfTreeEvaluate). Stops early
+        # once a time or evaluation budget is exhausted, see _checkBudgets().
+        if self._numOfCandidatesPerStep > 1:
+            return self._annealBatch(currentExpression, currentDelay, temperature, numOfIterations, annealingCounts)
+        reject = 0
+        hitCacheCount = 0
+        numOfTreeEvaluate = 0
+        traceSink = self._traceSink
+        profiling = Parameters.toProfilePhases
+        hasBudget = self._hasBudget()
+        for iterCount in range(numOfIterations):
+            if hasBudget and self._checkBudgets():
+                break
+            self._numOfNeighborEvaluations = self._numOfNeighborEvaluations + 1
+            foundValid = False
+            hitCache = False
+            neighborDelay = math.nan
+            slicingTree = None
+            if profiling:
+                PhaseProfiler.start("neighbor")
+            move = self._findNeighborMove(currentExpression)
+            currentExpression.applyMove(move)
+            if profiling:
+                PhaseProfiler.stop()
+            neighborExpression = currentExpression
+            foundNeighbor = self._satisfyFeatureSpecificConstraints(neighborExpression)
+            if isLogEnabled(1):
+                if profiling:
+                    PhaseProfiler.start("log")
                 if not self._bestExpression is None:
                     LOG("best exression = {}".format(self._bestExpression.getExpressionInfoCompactFormat()), 1)
                 LOG('Next Expr={}'.format(neighborExpression.getExpressionInfoCompactFormat()), 1)
-                if foundNeighbor:
-                    slicingTree = SkewedSlicingTree(neighborExpression)
-                    foundValid = slicingTree.satisfyFeatureSpecificConstraints(Parameters.featureConstrain)
-                if foundValid:
-                    slicingTree.evaluate()
-                    numOfTreeEvaluate = numOfTreeEvaluate + 1
-                    hitCache = slicingTree.hitCache()
-                    if hitCache:
-                        hitCacheCount = hitCacheCount + 1
-                    solvable = slicingTree.isSolvable()
-                    if solvable:
-                        neighborDelay = slicingTree.getMinimumDelay()
-                        self.appendDelaySample(neighborDelay)
-                        #deltaDelay = neighborDelay - currentDelay
-                        deltaDelay = neighborDelay - neighborDelay
-                        dieProb = self.die()
-                        try:
-                            temperatureProb = math.exp(-deltaDelay / temperature)
-                        except OverflowError:
-                            LOG(' temperatureProb overflow (too big), deltaCost = {}, temperature = {}'.format(
-                                deltaDelay, temperature))
-                            temperatureProb = 1.0
-
-                        upOrDownHill = 'd' if deltaDelay <= 0 else 'u'
-                        bestOrNot = '-'
-                        if deltaDelay <= 0 or dieProb < temperatureProb: # find better solution or up-hill climb
-                            prevExpression = currentExpression
-                            prevDelay = currentDelay
-                            currentExpression = copy.deepcopy(neighborExpression)
-                            currentDelay = neighborDelay
-
-                            bestOrNot = 'b' if neighborDelay < self._minimumDelay else '-'
-                            if neighborDelay < self._minimumDelay: # Find better solution
-                                self._minimumDelay = neighborDelay
-                                self._bestShapeSolution = copy.deepcopy(slicingTree.getBestShapeSolution())
-                                self._bestExpression = copy.deepcopy(neighborExpression)
-
+                if profiling:
+                    PhaseProfiler.stop()
+            if foundNeighbor:
+                if profiling:
+                    PhaseProfiler.start("treeBuild")
+                slicingTree = SkewedSlicingTree(neighborExpression)
+                if profiling:
+                    PhaseProfiler.stop()
+                    PhaseProfiler.start("constraints")
+                foundValid = slicingTree.satisfyFeatureSpecificConstraints(Parameters.featureConstrain)
+                if profiling:
+                    PhaseProfiler.stop()
+            if foundValid:
+                slicingTree.evaluate()  # timed in evaluate(), unless the constraint check evaluated it already
+                numOfTreeEvaluate = numOfTreeEvaluate + 1
+                hitCache = slicingTree.hitCache()
+                if hitCache:
+                    hitCacheCount = hitCacheCount + 1
+                solvable = slicingTree.isSolvable()
+                if solvable:
+                    neighborDelay = slicingTree.getMinimumDelay()
+                    self.appendDelaySample(neighborDelay)
+                    deltaDelay = neighborDelay - currentDelay
+                    dieProb = self.die()
+                    try:
+                        temperatureProb = math.exp(-deltaDelay / temperature)
+                    except OverflowError:
+                        LOG(' temperatureProb overflow (too big), deltaCost = {}, temperature = {}'.format(
+                            deltaDelay, temperature))
+                        temperatureProb = 1.0
+
+                    upOrDownHill = 'd' if deltaDelay <= 0 else 'u'
+                    bestOrNot = '-'
+                    self._numOfMetropolisTrials = self._numOfMetropolisTrials + 1
+                    if deltaDelay <= 0 or dieProb < temperatureProb: # find better solution or up-hill climb
+                        self._numOfMetropolisAccepts = self._numOfMetropolisAccepts + 1
+                        prevDelay = currentDelay
+                        currentDelay = neighborDelay
+
+                        bestOrNot = 'b' if neighborDelay < self._minimumDelay else '-'
+                        if neighborDelay < self._minimumDelay: # Find better solution
+                            if profiling:
+                                PhaseProfiler.start("copyBest")
+                            bestExpression = neighborExpression.copy()
+                            if profiling:
+                                PhaseProfiler.stop()
+                            self._updateBest(neighborDelay, slicingTree.getBestShapeSolution(), bestExpression)
+
+                        outcome = TraceEventSink.Outcome.Accepted
+                        if isLogEnabled(0):
                             self.LOG_SOLVABLE_BEST_UPDATE(annealingCounts, bestOrNot, dieProb, iterCount,
                                                           neighborDelay,
-                                                          neighborExpression, prevDelay, prevExpression,
+                                                          neighborExpression, prevDelay, move,
                                                           slicingTree,
                                                           temperature, temperatureProb, upOrDownHill)
 
-                        else:
-                            prevExpression = currentExpression
-                            reject = reject + 1
+                    else:
+                        reject = reject + 1
+                        outcome = TraceEventSink.Outcome.Rejected
+                        if isLogEnabled(0):
                             self.LOG_SOLVABLE_REJECT(annealingCounts, bestOrNot, currentDelay, dieProb, iterCount,
                                                      neighborDelay,
-                                                     neighborExpression, prevExpression, reject, slicingTree,
+                                                     neighborExpression, move, reject, slicingTree,
                                                      temperature,
                                                      temperatureProb, upOrDownHill)
-                    else:  # no solvable for neighbor expression
-                        dieProb = self.die()
-                        temperatureProb = self._acceptNonSolvableProb
-                        if dieProb < temperatureProb:
-                            prevExpression = currentExpression
-                            prevDelay = currentDelay
-                            currentExpression = copy.deepcopy(neighborExpression)
-                            currentDelay = self.getHeuristicDelay()
-
+                        currentExpression.undoMove(move)
+                else:  # no solvable for neighbor expression
+                    dieProb = self.die()
+                    temperatureProb = self._acceptNonSolvableProb
+                    if dieProb < temperatureProb:
+                        currentDelay = self.getHeuristicDelay()
+                        outcome = TraceEventSink.Outcome.UnsolvableAccepted
+                        if isLogEnabled(0):
                             self.LOG_NOSOLVABLE_UPHILL(annealingCounts, currentDelay, dieProb, iterCount,
-                                                       neighborExpression, prevExpression, reject, temperature,
+                                                       neighborExpression, move, reject, temperature,
                                                        temperatureProb)
-                        else:
-                            prevExpression = currentExpression
-                            reject = reject + 1
+                    else:
+                        reject = reject + 1
+                        outcome = TraceEventSink.Outcome.UnsolvableRejected
+                        if isLogEnabled(0):
                             self.LOG_NOSOLVABLE_REJECT(annealingCounts, currentDelay, dieProb, iterCount,
-                                                       neighborExpression, prevExpression, reject, temperature,
+                                                       neighborExpression, move, reject, temperature,
                                                        temperatureProb)
+                        currentExpression.undoMove(move)
 
-                else:
-                    dieProb = self.die()
-                    temperatureProb = self._acceptNotSatisfiedConstraintProb
-                    if dieProb < temperatureProb:
-                        prevExpression = currentExpression
-                        prevDelay = currentDelay
-                        currentExpression = copy.deepcopy(neighborExpression)
-                        currentDelay = self.getHeuristicDelay()
+            else:
+                dieProb = self.die()
+                temperatureProb = self._acceptNotSatisfiedConstraintProb
+                if dieProb < temperatureProb:
+                    currentDelay = self.getHeuristicDelay()
+                    outcome = TraceEventSink.Outcome.InvalidAccepted
+                    if isLogEnabled(0):
                         self.LOG_NOT_FOUND_VALID_NEIGHBOR(annealingCounts, iterCount, reject, temperature)
-                    else:
+                else:
+                    reject = reject + 1
+                    outcome = TraceEventSink.Outcome.InvalidRejected
+                    if isLogEnabled(0):
                         if not foundNeighbor:
-                            LOG('{} not found neighbors for expression {}'.format(annealingCounts,
-                                                                              currentExpression.getExpressionInfoCompactFormat()))
+                            LOG('{} not found neighbors by move {} for expression {}'.format(
+                                annealingCounts, move, neighborExpression.getExpressionInfoCompactFormat()))
                         else:
-                            LOG('{} expression {} -> neighbor {}, but it is not valid'.format(annealingCounts,
-                                                                                          currentExpression.getExpressionInfoCompactFormat(),
-                                                                                          neighborExpression.getExpressionInfoCompactFormat()))
-                        reject = reject + 1
+                            LOG('{} move {} -> neighbor {}, but it is not valid'.format(
+                                annealingCounts, move, neighborExpression.getExpressionInfoCompactFormat()))
                         self.LOG_NOT_FOUND_VALID_NEIGHBOR(annealingCounts, iterCount, reject, temperature)
-
+                    currentExpression.undoMove(move)
+
+            if traceSink is not None:
+                traceSink.record(annealingCounts, iterCount, move.operation.value, move.index, outcome.value, hitCache,
+                                 neighborDelay, currentDelay, self._minimumDelay, temperature)
+
+        return currentDelay, reject, hitCacheCount, numOfTreeEvaluate
+
+    def _nextAdaptiveStage(self, temperature, numOfIterations, numOfTrials, numOfAccepts):
+        # (temperature, numOfIterations) of the next stage from the Metropolis acceptance ratio of the last one;
+        # unchanged rate and iterations if it judged no solvable neighbor
+        if numOfTrials == 0:
+            return temperature * self._temperatureAnnealingRate, numOfIterations
+        acceptRatio = 1.0 * numOfAccepts / numOfTrials
+        if acceptRatio > self._targetAcceptRatio:
+            temperature = temperature * self._temperatureAnnealingRate ** 2
+        else:
             temperature = temperature * self._temperatureAnnealingRate
-            if numOfTreeEvaluate == 0:
-                numOfTreeEvaluate = 1
-            self._cacheHitRate = (1.0 * hitCacheCount / numOfTreeEvaluate)
-            LOG("{} hit cache rate = {:.2f}({}/{}), cacheSize = {}".format(annealingCounts, self._cacheHitRate,
-                                                                           hitCacheCount, numOfTreeEvaluate,
-                                                                           SlicingTreeSolutionCache.cacheSize()), 0)
-            annealingCounts = annealingCounts + 1
-            if (1.0 * reject / self._numIterationPerTemperature) > self._rejectRatioThreshold \
-                    or temperature < self._frozenTemperature \
-                    or annealingCounts > self._maxAnnealingCount \
-                    or self._cacheHitRate > self._hitCacheThreshold:
-                continueAnnealing = False
-                if (1.0 * reject / self._numIterationPerTemperature) > self._rejectRatioThreshold:
-                    self._terminateReason = AnnealingSimulator.TerminateReason.NeighborsRejectRateTooHigh
-                elif temperature < self._frozenTemperature:
-                    self._terminateReason = AnnealingSimulator.TerminateReason.FrozenTemperatureReached
-                elif annealingCounts > self._maxAnnealingCount:
-                    self._terminateReason = AnnealingSimulator.TerminateReason.MaxAnnealCountReached
-                else:
-                    self._terminateReason = AnnealingSimulator.TerminateReason.ToHighHitCacheRate
-            else:
+        maxNumOfIterations = self._numIterationPerTemperature if self._maxNumIterationPerTemperature is None \
+            else self._maxNumIterationPerTemperature
+        numOfIterations = int(math.ceil(self._numIterationPerTemperature * self._targetAcceptRatio
+                                        / max(acceptRatio, 1e-3)))
+        numOfIterations = min(max(numOfIterations, 1), maxNumOfIterations)
+        return temperature, numOfIterations
+
+    def runSimulation(self):
+        self._stopTime = self._deadline
+        if self._timeBudget is not None:
+            budgetEnd = time.monotonic() + self._timeBudget
+            self._stopTime = budgetEnd if self._stopTime is None else min(self._stopTime, budgetEnd)
+        self._exhaustedBudget = None
+        currentExpression = self._startExpression.copy()  # perturbed in place, moves are undone when rejected
+        currentDelay = self._minimumDelay
+        annealingCounts = 0
+        numOfIterations = self._numIterationPerTemperature
+        profiling = Parameters.toProfilePhases
+        if profiling:
+            PhaseProfiler.reset()
+            PhaseProfiler.start("runSimulation")
+        if not SoftModuleInfo.isSweepMode():  # a sweep keeps its fronts across the runs of its capacities
+            SlicingTreeSolutionCache.reset()
+            SubtreeShapeCache.reset()
+        if self._toEstimateDeltaAvg:
+            if profiling:
+                PhaseProfiler.start("estimateDeltaAvg")
+            deltaAvg = self._estimateDeltaAvg()
+            if profiling:
+                PhaseProfiler.stop()
+            if deltaAvg is not None:
+                self._deltaAvg = deltaAvg
+        temperature = -self._deltaAvg / math.log(self._initProbabilityToAcceptUphill)
+        LOG("delta avg = {:.2f}, start temperature = {:.2f}", 0, self._deltaAvg, temperature)
+
+        if self._numOfCandidatesPerStep > 1 and self._numOfCandidateProcesses > 1:
+            self._candidatePool = multiprocessing.Pool(processes=self._numOfCandidateProcesses,
+                                                       initializer=WorkerContext.restore,
+                                                       initargs=(WorkerContext.capture(), ))
+        try:
+            while True:
                 continueAnnealing = True
-            if not continueAnnealing:
-                break
+                numOfTrials = self._numOfMetropolisTrials
+                numOfAccepts = self._numOfMetropolisAccepts
+                if profiling:
+                    PhaseProfiler.start("anneal")
+                (currentDelay, reject, hitCacheCount, numOfTreeEvaluate) = self._anneal(
+                    currentExpression, currentDelay, temperature, numOfIterations, annealingCounts)
+                if profiling:
+                    PhaseProfiler.stop()
+                self._numOfTreeEvaluations = self._numOfTreeEvaluations + numOfTreeEvaluate
+                rejectRatio = 1.0 * reject / numOfIterations
+                if self._targetAcceptRatio is None:
+                    temperature = temperature * self._temperatureAnnealingRate
+                else:
+                    (temperature, numOfIterations) = self._nextAdaptiveStage(
+                        temperature, numOfIterations, self._numOfMetropolisTrials - numOfTrials,
+                        self._numOfMetropolisAccepts - numOfAccepts)
+                if numOfTreeEvaluate == 0:
+                    numOfTreeEvaluate = 1
+                self._cacheHitRate = (1.0 * hitCacheCount / numOfTreeEvaluate)
+                LOG("{} hit cache rate = {:.2f}({}/{}), cacheSize = {}", 0, annealingCounts, self._cacheHitRate,
+                    hitCacheCount, numOfTreeEvaluate, SlicingTreeSolutionCache.cacheSize())
+                annealingCounts = annealingCounts + 1
+                if self._exhaustedBudget is not None:
+                    self._terminateReason = self._exhaustedBudget
+                    break
+                if rejectRatio > self._rejectRatioThreshold \
+                        or temperature < self._frozenTemperature \
+                        or annealingCounts > self._maxAnnealingCount \
+                        or self._cacheHitRate > self._hitCacheThreshold:
+                    continueAnnealing = False
+                    if rejectRatio > self._rejectRatioThreshold:
+                        self._terminateReason = AnnealingSimulator.TerminateReason.NeighborsRejectRateTooHigh
+                    elif temperature < self._frozenTemperature:
+                        self._terminateReason = AnnealingSimulator.TerminateReason.FrozenTemperatureReached
+                    elif annealingCounts > self._maxAnnealingCount:
+                        self._terminateReason = AnnealingSimulator.TerminateReason.MaxAnnealCountReached
+                    else:
+                        self._terminateReason = AnnealingSimulator.TerminateReason.ToHighHitCacheRate
+                else:
+                    continueAnnealing = True
+                if not continueAnnealing:
+                    break
+        finally:
+            if self._candidatePool is not None:
+                self._candidatePool.close()
+                self._candidatePool.join()
+                self._candidatePool = None
+        if profiling:
+            PhaseProfiler.stop()
 
     def LOG_NOT_FOUND_VALID_NEIGHBOR(self, annealingCounts, iterCount, reject, temperature):
         LOG(
@@ -322,46 +635,46 @@ class AnnealingSimulator:
                 reject), 0)
 
     def LOG_NOSOLVABLE_REJECT(self, annealingCounts, currentDelay, dieProb, iterCount, neighborExpression,
-                              prevExpression, reject, temperature, temperatureProb):
+                              move, reject, temperature, temperatureProb):
         LOG(
-            "[{}-{}] A-{}-A-{} Ecnb:[{}][{}][{}] Snb:["
+            "[{}-{}] A-{}-A-{} Emnb:[{}][{}][{}] Snb:["
             "{}][{}] Ccnb:[{}][{}][{}] "
             "T:{:.2f}, DP:{:.2f} TP:{:.2f}, RJ:{}".format(
                 annealingCounts, iterCount, "!", "-",
-                prevExpression.getExpressionInfoCompactFormat(),
+                move,
                 neighborExpression.getExpressionInfoCompactFormat(),
-                self._bestExpression.getExpressionInfoCompactFormat(),
+                "None" if self._bestExpression is None else self._bestExpression.getExpressionInfoCompactFormat(),
                 "None",
                 SkewedSlicingTree.packetSolutionInfo(self._bestShapeSolution),
                 currentDelay, "None", self._minimumDelay,
                 temperature, dieProb, temperatureProb, reject), 0)
 
     def LOG_NOSOLVABLE_UPHILL(self, annealingCounts, currentDelay, dieProb, iterCount, neighborExpression,
-                              prevExpression, reject, temperature, temperatureProb):
+                              move, reject, temperature, temperatureProb):
         LOG(
-            "[{}-{}] A-{}-B-{} Ecnb:[{}][{}][{}] Snb:["
+            "[{}-{}] A-{}-B-{} Emnb:[{}][{}][{}] Snb:["
             "{}][{}] Ccnb:[{}][{}][{}] "
             "T:{:.2f}, DP:{:.2f} TP:{:.2f}, RJ:{}".format(
                 annealingCounts, iterCount, "!", "-",
-                prevExpression.getExpressionInfoCompactFormat(),
+                move,
                 neighborExpression.getExpressionInfoCompactFormat(),
-                self._bestExpression.getExpressionInfoCompactFormat(),
+                "None" if self._bestExpression is None else self._bestExpression.getExpressionInfoCompactFormat(),
                 "None",
                 SkewedSlicingTree.packetSolutionInfo(self._bestShapeSolution),
                 currentDelay, "None", self._minimumDelay,
                 temperature, dieProb, temperatureProb, reject), 0)
 
     def LOG_SOLVABLE_REJECT(self, annealingCounts, bestOrNot, currentDelay, dieProb, iterCount, neighborDelay,
-                            neighborExpression, prevExpression, reject, slicingTree, temperature, temperatureProb,
+                            neighborExpression, move, reject, slicingTree, temperature, temperatureProb,
                             upOrDownHill):
         LOG(
-            "[{}-{}] A-{}-A-{} Ecnb:[{}][{}][{}] Snb:["
+            "[{}-{}] A-{}-A-{} Emnb:[{}][{}][{}] Snb:["
             "{}][{}] Ccnb:[{}][{}][{}] "
             "T:{:.2f}, DP:{:.2f}, TP:{:.2f}, RJ:{}".format(
                 annealingCounts, iterCount, upOrDownHill, bestOrNot,
-                prevExpression.getExpressionInfoCompactFormat(),
+                move,
                 neighborExpression.getExpressionInfoCompactFormat(),
-                self._bestExpression.getExpressionInfoCompactFormat(),
+                "None" if self._bestExpression is None else self._bestExpression.getExpressionInfoCompactFormat(),
                 SkewedSlicingTree.packetSolutionInfo(slicingTree.getBestShapeSolution()),
                 SkewedSlicingTree.packetSolutionInfo(self._bestShapeSolution),
                 currentDelay, neighborDelay, self._minimumDelay,
@@ -369,14 +682,14 @@ class AnnealingSimulator:
 
     def LOG_SOLVABLE_BEST_UPDATE(self, annealingCounts, bestOrNot, dieProb, iterCount, neighborDelay,
                                  neighborExpression,
-                                 prevDelay, prevExpression, slicingTree, temperature, temperatureProb, upOrDownHill):
+                                 prevDelay, move, slicingTree, temperature, temperatureProb, upOrDownHill):
         LOG(
-            "[{}-{}] A-{}-B-{} Ecnb:[{}][{}][{}] Snb:[{}][{}] Ccnb:[{}][{}][{}] "
+            "[{}-{}] A-{}-B-{} Emnb:[{}][{}][{}] Snb:[{}][{}] Ccnb:[{}][{}][{}] "
             "T:{:.2f}, DP:{:.2f}, TP:{:.2f}".format(
                 annealingCounts, iterCount, upOrDownHill, bestOrNot,
-                prevExpression.getExpressionInfoCompactFormat(),
+                move,
                 neighborExpression.getExpressionInfoCompactFormat(),
-                self._bestExpression.getExpressionInfoCompactFormat(),
+                "None" if self._bestExpression is None else self._bestExpression.getExpressionInfoCompactFormat(),
                 SkewedSlicingTree.packetSolutionInfo(slicingTree.getBestShapeSolution()),
                 SkewedSlicingTree.packetSolutionInfo(self._bestShapeSolution),
                 prevDelay, neighborDelay, self._minimumDelay,
@@ -0,0 +1,208 @@
+import argparse
+import json
+import math
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import numpy as np
+from AnnealingSimulator import AnnealingSimulator
+from NormPolishExpression import NormPolishExpression
+from SkewedSlicingTree import SkewedSlicingTree
+from SlicingTreeSolutionCache import SlicingTreeSolutionCache
+from SubtreeShapeCache import SubtreeShapeCache
+from SoftModuleInfo import SoftModuleInfo
+from PrecedenceConstraints import PrecedenceConstraints
+from Parameters import Parameters
+
+# Throughput and scaling benchmarks of the hot paths on synthetic instances, printed as JSON, e.g.
+#   python Benchmark.py --units 1,2,4 --shapes 1,3 --capacity-scales 1.0,0.6 --output bench.json
+
+basic_task_shapes = [(5, 6), (2, 3), (6, 3), (5, 3)]  # (w, h) of the 4 tasks of a unit, as in ResourcePlanning
+num_task_per_unit = 4
+
+
+def generateInstance(num_of_unit, shapesPerModule, capacityScale, seed):
+    # Loads a synthetic instance into SoftModuleInfo: the ResourcePlanning units with their task sizes jittered,
+    # shapesPerModule work-preserving variants per task (fewer persons for more days), random task weights and the
+    # per-unit precedences. Hmax/Wmax are capacityScale times the stacked heights/widths of all base shapes.
+    # Returns the default per-unit start expression.
+    rng = random.Random(seed)
+    shapeInfoMap = []
+    task_weights = {}
+    sumOfHeights = 0
+    sumOfWidths = 0
+    for unit_id in range(num_of_unit):
+        for task_id_within_unit in range(num_task_per_unit):
+            task_id = unit_id * num_task_per_unit + task_id_within_unit
+            (w, h) = basic_task_shapes[task_id_within_unit]
+            w = max(1, w + rng.randint(-1, 1))
+            h = max(1, h + rng.randint(-1, 1))
+            sumOfWidths += w
+            sumOfHeights += h
+            shapes = []
+            for variant in range(shapesPerModule):
+                height = max(1, h - variant)
+                width = int(math.ceil(1.0 * w * h / height))
+                shapes.append({"n": 1, "w": width, "h": height, "d": width, "wd": 0, "s": [0], "f": [0],
+                               "id": ["{}-{}".format(task_id, variant)]})
+            shapeInfoMap.append(shapes)
+            task_weights[task_id] = rng.choice([0.5, 1.0, 2.0])
+
+    SoftModuleInfo.setInfoMap(shapeInfoMap)
+    SoftModuleInfo.setUeWeights(task_weights)
+    SoftModuleInfo.setPrecedenceConstraints(PrecedenceConstraints.perUnitTemplate(num_task_per_unit * num_of_unit,
+                                                                                  num_task_per_unit))
+    SoftModuleInfo.setHmax(max(1, int(capacityScale * sumOfHeights)))
+    SoftModuleInfo.setWmax(max(1, int(capacityScale * sumOfWidths)))
+
+    expressions = []
+    for unit in range(num_of_unit):
+        expressions.extend([4 * unit, 4 * unit + 1, 4 * unit + 2, "F", 4 * unit + 3, "F", "T"])
+        if unit > 0:
+            expressions.append("T")
+    return expressions
+
+
+def _resetCaches():
+    SlicingTreeSolutionCache.reset()
+    SubtreeShapeCache.reset()
+
+
+def _randomWalk(startExpression, numOfExpressions, seed):
+    # numOfExpressions expressions along a random walk of perturbations from the start expression
+    simulator = AnnealingSimulator()
+    simulator.setRandomSeed(seed)
+    expression = NormPolishExpression(startExpression)
+    expressions = []
+    for index in range(numOfExpressions):
+        expression.applyMove(simulator._findNeighborMove(expression))
+        expressions.append(expression.copy())
+    return expressions
+
+
+def benchmarkEvaluate(startExpression, numOfEvaluations, seed):
+    # evaluate() calls/sec on a random walk: cold (empty caches) and warm (every tree evaluated once before)
+    expressions = _randomWalk(startExpression, numOfEvaluations, seed)
+    _resetCaches()
+    startTime = time.perf_counter()
+    numOfSolvable = 0
+    for expression in expressions:
+        slicingTree = SkewedSlicingTree(expression)
+        slicingTree.evaluate()
+        numOfSolvable += slicingTree.isSolvable()
+    coldSeconds = time.perf_counter() - startTime
+    startTime = time.perf_counter()
+    for expression in expressions:
+        SkewedSlicingTree(expression).evaluate()
+    warmSeconds = time.perf_counter() - startTime
+    return {"evaluations": len(expressions),
+            "coldEvaluatePerSecond": len(expressions) / max(coldSeconds, 1e-9),
+            "warmEvaluatePerSecond": len(expressions) / max(warmSeconds, 1e-9),
+            "solvableRatio": 1.0 * numOfSolvable / max(len(expressions), 1)}
+
+
+def benchmarkNeighbors(startExpression, numOfMoves, seed):
+    # sampled, applied and undone moves per second
+    simulator = AnnealingSimulator()
+    simulator.setRandomSeed(seed)
+    expression = NormPolishExpression(startExpression)
+    startTime = time.perf_counter()
+    for index in range(numOfMoves):
+        move = simulator._findNeighborMove(expression)
+        expression.applyMove(move)
+        if index % 2 == 1:  # keep every other move, so that the walk leaves the start expression
+            expression.undoMove(move)
+    seconds = time.perf_counter() - startTime
+    return {"moves": numOfMoves, "neighborsPerSecond": numOfMoves / max(seconds, 1e-9)}
+
+
+def _runAnnealing(startExpression, maxAnnealingCount, numIterationPerTemperature, seed):
+    simulator = AnnealingSimulator()
+    simulator.setRandomSeed(seed)
+    simulator.setTemperatureAnnealingRate(0.99)
+    simulator.setStartTemperature(100)
+    simulator.setMaxAnnealingCount(maxAnnealingCount)
+    simulator.setNumIterationPerTemperature(numIterationPerTemperature)
+    simulator.setStartExpression(startExpression)
+    simulator.runSimulation()
+    return simulator.solutionResult()
+
+
+def benchmarkRun(startExpression, maxAnnealingCount, numIterationPerTemperature, seed, toMeasureMemory):
+    # wall time, result and cache hit rate of a full annealing run; peak traced memory from a second, identical run
+    startTime = time.perf_counter()
+    result = _runAnnealing(startExpression, maxAnnealingCount, numIterationPerTemperature, seed)
+    seconds = time.perf_counter() - startTime
+    record = {"runSeconds": seconds,
+              "minimumDelay": None if math.isinf(result["minimumDelay"]) else result["minimumDelay"],
+              "cacheHitRate": result["cacheHitRate"],
+              "solutionCacheSize": SlicingTreeSolutionCache.cacheSize(),
+              "subtreeCacheSize": SubtreeShapeCache.cacheSize(),
+              "terminateReason": AnnealingSimulator.TerminateReason(result["terminateReason"]).name,
+              "peakTracedBytes": None}
+    if toMeasureMemory:
+        tracemalloc.start()
+        _runAnnealing(startExpression, maxAnnealingCount, numIterationPerTemperature, seed)
+        record["peakTracedBytes"] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return record
+
+
+def runBenchmarks(units, shapesPerModule, capacityScales, numOfEvaluations, numOfMoves, maxAnnealingCount,
+                  numIterationPerTemperature, seed, toMeasureMemory):
+    records = []
+    for num_of_unit in units:
+        for shapes in shapesPerModule:
+            for capacityScale in capacityScales:
+                startExpression = generateInstance(num_of_unit, shapes, capacityScale, seed)
+                record = {"units": num_of_unit, "shapesPerModule": shapes, "capacityScale": capacityScale,
+                          "Hmax": SoftModuleInfo.Hmax, "Wmax": SoftModuleInfo.Wmax}
+                record.update(benchmarkEvaluate(startExpression, numOfEvaluations, seed))
+                record.update(benchmarkNeighbors(startExpression, numOfMoves, seed))
+                record.update(benchmarkRun(startExpression, maxAnnealingCount, numIterationPerTemperature, seed,
+                                           toMeasureMemory))
+                records.append(record)
+                print(json.dumps(record), file=sys.stderr)
+    return {"environment": {"python": platform.python_version(), "numpy": np.__version__,
+                            "machine": platform.machine()},
+            "parameters": {"numOfEvaluations": numOfEvaluations, "numOfMoves": numOfMoves,
+                           "maxAnnealingCount": maxAnnealingCount,
+                           "numIterationPerTemperature": numIterationPerTemperature, "seed": seed,
+                           "featureConstrain": Parameters.FeatureConstrains(Parameters.featureConstrain).name,
+                           "toUseWeightedDelayAsCost": Parameters.toUseWeightedDelayAsCost},
+            "results": records}
+
+
+def _parseList(text, cast):
+    return [cast(item) for item in text.split(",") if len(item) > 0]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark tree evaluation, neighbor generation and full runs.")
+    parser.add_argument("--units", default="1,2,4", help="comma separated num_of_unit values")
+    parser.add_argument("--shapes", default="1,3", help="comma separated shapes per module")
+    parser.add_argument("--capacity-scales", default="1.0,0.6",
+                        help="comma separated Hmax/Wmax fractions of the stacked base shapes")
+    parser.add_argument("--evaluations", type=int, default=2000)
+    parser.add_argument("--moves", type=int, default=20000)
+    parser.add_argument("--anneal-count", type=int, default=20)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--constraint", default=Parameters.featureConstrain.name,
+                        choices=[constrain.name for constrain in Parameters.FeatureConstrains])
+    parser.add_argument("--no-memory", action="store_true", help="skip the traced peak memory run")
+    parser.add_argument("--output", default=None, help="JSON file to write, stdout if omitted")
+    args = parser.parse_args()
+
+    Parameters.logLevel = 2
+    Parameters.featureConstrain = Parameters.FeatureConstrains[args.constraint]
+    report = runBenchmarks(_parseList(args.units, int), _parseList(args.shapes, int),
+                           _parseList(args.capacity_scales, float), args.evaluations, args.moves, args.anneal_count,
+                           args.iterations, args.seed, not args.no_memory)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
@@ -0,0 +1,42 @@
+
+class IndexedSet:
+    # A set that also supports indexing, so that a uniformly random member is picked in O(1):
+    # add, discard and membership are O(1) too (removal moves the last item into the freed slot).
+
+    def __init__(self, items=()):
+        self._items = []
+        self._indexOf = {}
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, item):
+        return item in self._indexOf
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def add(self, item):
+        if item not in self._indexOf:
+            self._indexOf[item] = len(self._items)
+            self._items.append(item)
+
+    def discard(self, item):
+        index = self._indexOf.pop(item, None)
+        if index is None:
+            return
+        last = self._items.pop()
+        if index < len(self._items):
+            self._items[index] = last
+            self._indexOf[last] = index
+
+    def copy(self):
+        duplicate = IndexedSet()
+        duplicate._items = list(self._items)
+        duplicate._indexOf = dict(self._indexOf)
+        return duplicate
@@ -1,9 +1,15 @@
+import math
 from TreeNode import TreeNode
 from Utilities import overrides, LOG
 from NodeTag import NodeTag
 from SoftModuleInfo import SoftModuleInfo
 from SLIV import SLIV
-import copy
+from SubtreeShapeCache import SubtreeShapeCache
+from ShapeCombinationKernel import ShapeCombinationKernel
+from ParetoFront import ParetoFront
+from PrecedenceConstraints import PrecedenceConstraints
+from PhaseProfiler import PhaseProfiler
+from ShapeRecord import ShapeRecord
 from Parameters import Parameters
 
 
@@ -14,6 +20,7 @@ class InternalNode(TreeNode):
         self._leftNode = leftNode
         self._rightNode = rightNode
         self.numOfShapeCombination = 0
+        self.signatureId = SubtreeShapeCache.signatureIdOf(tag, leftNode.signatureId, rightNode.signatureId)
 
     def leftNode(self):
         return self._leftNode
@@ -27,7 +34,8 @@ class InternalNode(TreeNode):
 
     @overrides(TreeNode)
     def getNumOfShapeToCache(self):
-        return len(self.shapes) + self._leftNode.getNumOfShapeToCache() + self._rightNode.getNumOfShapeToCache()
+        numOfShapes = 0 if self.shapes is None else len(self.shapes)  # children are not evaluated on a memo hit
+        return numOfShapes + self._leftNode.getNumOfShapeToCache() + self._rightNode.getNumOfShapeToCache()
 
     @overrides(TreeNode)
     def postTraversal(self, func):
@@ -41,8 +49,40 @@ class InternalNode(TreeNode):
                 for shape in self.shapes:
                     func(shape)
 
+    def _subtreeShapeCacheKey(self):
+        return (self.signatureId, SoftModuleInfo.evaluationHmax(), SoftModuleInfo.evaluationWmax(), self.canStartPosBeFixed(),
+                Parameters.toUseWeightedDelayAsCost, self._toFilterPrecedence())
+
+    @staticmethod
+    def _toFilterPrecedence():
+        return Parameters.toFilterPrecedenceInSubtrees \
+            and Parameters.featureConstrain == Parameters.FeatureConstrains.ETaskPrecedence
+
+    @staticmethod
+    def _filterPrecedence(shapes):
+        # Start positions within a subtree only move together (T shifts its whole right subtree), so a precedence
+        # or exclusion violated among the tasks placed so far stays violated at the root.
+        if len(shapes) == 0:
+            return shapes
+        shapeById = SoftModuleInfo.shapeById
+        taskIds = [SoftModuleInfo.taskIdById[id] for id in shapes[0]["id"]]  # same task order in every shape of a node
+        starts = [shape["s"] for shape in shapes]
+        completions = [[start + shapeById[id]["w"] for (start, id) in zip(shape["s"], shape["id"])] for shape in shapes]
+        feasible = PrecedenceConstraints.active().feasibleMask(taskIds, starts, completions)
+        return [shape for (shape, isFeasible) in zip(shapes, feasible) if isFeasible]
+
     @overrides(TreeNode)
     def evaluateShapes(self):
+        profiling = Parameters.toProfilePhases
+        if Parameters.toMemoizeSubtreeShapes:
+            subtreeKey = self._subtreeShapeCacheKey()
+            (cached, cachedShapes) = SubtreeShapeCache.fetchCache(subtreeKey)
+            if cached:  # unchanged subtree, e.g. off the path from a perturbation to the root
+                if profiling:
+                    PhaseProfiler.count("subtreeMemoHits")
+                self.shapes = cachedShapes
+                return self.shapes
+
         leftShapes = self._leftNode.evaluateShapes()
         if NodeTag.isT(self.nodeTag):
             self.rightEnterFromNodeT()
@@ -50,106 +90,99 @@ class InternalNode(TreeNode):
         if NodeTag.isT(self.nodeTag):
             self.rightReturnFromNodeT()
         self.numOfShapeCombination = len(leftShapes) * len(rightShapes)
-        shapes = []
-        # combine shapes according to tag
-        if NodeTag.isF(self.nodeTag):
-            for left in leftShapes:
-                for right in rightShapes:
-                    shape = dict()
-                    shape["n"] = left["n"] + right["n"]
-                    shape["w"] = max(left["w"], right["w"])
-                    shape["h"] = left["h"] + right["h"]
-                    shape["d"] = left["d"] + right["d"]
-                    sminLeft = min(left["s"])
-                    sminRight = min(right["s"])
-                    assert(sminLeft == sminRight)
-                    shape["s"] = left["s"] + right["s"]
-                    shape["id"] = left["id"] + right["id"]
-                    fminLeft = min(left["f"])
-                    fminRight = min(right["f"])
-                    assert(fminLeft == fminRight)
-                    startOfRight = fminLeft + left["h"]
-                    shape["f"] = left["f"] + [y + startOfRight for y in right["f"]]
-                    self.calculateWeightedDelay(shape)
-                    if shape["h"] <= SoftModuleInfo.Hmax:
-                        shapes.append(shape)
-        elif NodeTag.isT(self.nodeTag):
-            for left in leftShapes:
-                for right in rightShapes:
-                    shape = dict()
-                    shape["n"] = left["n"] + right["n"]
-                    shape["w"] = left["w"] + right["w"]
-                    shape["h"] = max(left["h"], right["h"])
-                    shape["d"] = left["d"] + left["w"] * right["n"] + right["d"]
-                    sminLeft = min(left["s"])
-                    sminRight = min(right["s"])
-                    assert(sminLeft == sminRight)
-                    startOfRight = sminLeft + left["w"]
-                    shape["s"] = left["s"] + [x + startOfRight for x in right["s"]]
-                    shape["id"] = left["id"] + right["id"]
-                    shape["f"] = left["f"] + right["f"]
-                    self.calculateWeightedDelay(shape)
-                    if shape["w"] <= SoftModuleInfo.Wmax:
-                        shapes.append(shape)
+        if profiling:
+            PhaseProfiler.start("combine")
+        shapes = self._combineShapes(leftShapes, rightShapes)
+        if profiling:
+            PhaseProfiler.stop()
+            PhaseProfiler.start("filter")
 
         # remove none-SLIV supported format
-        shapesWithSLIV = []
-        if self.canStartPosBeFixed():
-            LOG("DEBUG: start pos fixed at node {}".format(self.nodeTag), 0)
-            for shape in shapes:
-                allShapesAllowed = True
-                for startSymb, id in zip(shape["s"], shape["id"]):
-                    shapeInfo = SoftModuleInfo.getShapeInfoById(id)
-                    numOfSym = shapeInfo["w"]
-                    assert(len(shapeInfo["s"]) == 1)
-                    if not SLIV.isAllowedSLIV(startSymb, numOfSym):
-                        LOG("SLIV banned {} because of shapeInfo = {}, SLIV=({}, {})".format(shape, shapeInfo, startSymb, numOfSym), 0)
-                        allShapesAllowed = False
-                if allShapesAllowed:
-                    shapesWithSLIV.append(shape)
-
+        if self.canStartPosBeFixed() and not SLIV.isUnrestricted():
+            LOG("DEBUG: start pos fixed at node {}", 0, self.nodeTag)
+            shapesWithSLIV = SLIV.allowedShapes(shapes, SoftModuleInfo.shapeWidthById)
+            if len(shapesWithSLIV) < len(shapes):
+                LOG("SLIV banned {} of {} shapes at node {}", 0, len(shapes) - len(shapesWithSLIV), len(shapes),
+                    self.nodeTag)
         else:
-            LOG("DEBUG: start pos not fixed at node {}".format(self.nodeTag), 0)
-            shapesWithSLIV = copy.deepcopy(shapes)
-
-        shapesAfterPrune = copy.deepcopy(shapesWithSLIV)
-        if Parameters.toUseWeightedDelayAsCost:
-            shapesAfterPrune.sort(key=lambda item: item['wd'])
-        else:
-            shapesAfterPrune.sort(key=lambda item: item['d'])
-        indexHeader = 0
-        while indexHeader < len(shapesAfterPrune):
-            shapeHeader = shapesAfterPrune[indexHeader]
-            indexForward = indexHeader + 1
-            while indexForward < len(shapesAfterPrune):
-                shapeForward = shapesAfterPrune[indexForward]
-                if shapeForward['w'] >= shapeHeader['w'] and shapeForward['h'] >= shapeHeader['h']:
-                    shapesAfterPrune.pop(indexForward)  # remove the redundant item but keep forward index in the same place
-                else:
-                    indexForward = indexForward + 1
-
-            indexHeader = indexHeader + 1
+            LOG("DEBUG: start pos not fixed at node {}", 0, self.nodeTag)
+            shapesWithSLIV = shapes
+
+        if self._toFilterPrecedence():  # before the pruning, so that a feasible dominated shape survives
+            shapesWithSLIV = self._filterPrecedence(shapesWithSLIV)
+
+        if profiling:
+            PhaseProfiler.stop()
+            PhaseProfiler.start("prune")
+        shapesAfterPrune = shapesWithSLIV  # shapes are immutable, shared without copies
+        costKey = 'wd' if Parameters.toUseWeightedDelayAsCost else 'd'
+        keptIndices = ParetoFront.prune([shape[costKey] for shape in shapesAfterPrune],
+                                        [shape['w'] for shape in shapesAfterPrune],
+                                        [shape['h'] for shape in shapesAfterPrune])
+        shapesAfterPrune = [shapesAfterPrune[index] for index in keptIndices]
+        if profiling:
+            PhaseProfiler.stop()
+            PhaseProfiler.count("evaluatedNodes")
+            PhaseProfiler.count("shapeCombinations", self.numOfShapeCombination)
+            PhaseProfiler.count("frontShapes", len(shapesAfterPrune))
+            PhaseProfiler.observeMax("frontSize", len(shapesAfterPrune))
 
         if len(shapesAfterPrune) == 0:
-            LOG("WARNING: no shapes at node tag {}".format(self.nodeTag), 0)
+            LOG("WARNING: no shapes at node tag {}", 0, self.nodeTag)
         else:
-            LOG("DEBUG: {} shapes at node tag {}".format(len(shapesAfterPrune), self.nodeTag), 0)
+            LOG("DEBUG: {} shapes at node tag {}", 0, len(shapesAfterPrune), self.nodeTag)
 
         self.shapes = shapesAfterPrune
+        if Parameters.toMemoizeSubtreeShapes:
+            SubtreeShapeCache.addCache(subtreeKey, self.shapes)
         return self.shapes
 
-    def calculateWeightedDelay(self, shape):
-        # update the weighted delay
+    def _combineShapes(self, leftShapes, rightShapes):
+        # combine shapes according to tag, in batch, and return them sorted by cost
+        ueWeights = SoftModuleInfo.ueWeights
+        taskIdById = SoftModuleInfo.taskIdById
+        rightWeight = 0.0 if len(rightShapes) == 0 else sum([ueWeights[taskIdById[id]] for id in rightShapes[0]["id"]])
+        combination = ShapeCombinationKernel.combine(self.nodeTag, leftShapes, rightShapes,
+                                                     SoftModuleInfo.evaluationHmax(), SoftModuleInfo.evaluationWmax(),
+                                                     rightWeight)
+        costKey = 'wd' if Parameters.toUseWeightedDelayAsCost else 'd'
+        order = ShapeCombinationKernel.sortOrder(combination[costKey])  # only the sorted shapes are built
+
+        isF = NodeTag.isF(self.nodeTag)
+        shapes = []
+        for index in order:
+            left = leftShapes[combination["left"][index]]
+            right = rightShapes[combination["right"][index]]
+            ids = left["id"] + right["id"]
+            if isF:
+                startOfRight = min(left["f"]) + left["h"]
+                starts = left["s"] + right["s"]
+                fStarts = left["f"] + tuple([y + startOfRight for y in right["f"]])
+            else:
+                startOfRight = min(left["s"]) + left["w"]
+                starts = left["s"] + tuple([x + startOfRight for x in right["s"]])
+                fStarts = left["f"] + right["f"]
+            weightedDelay = combination["wd"][index]
+            if Parameters.toVerifyWeightedDelay:
+                assert(math.isclose(weightedDelay, self.calculateWeightedDelay(starts, ids), rel_tol=1e-9, abs_tol=1e-9))
+            shapes.append(ShapeRecord.make(combination["n"][index], combination["w"][index],
+                                           combination["h"][index], combination["d"][index],
+                                           weightedDelay, starts, fStarts, ids))
+        return shapes
+
+    def calculateWeightedDelay(self, starts, shapeIds):
+        # the weighted delay of the tasks placed at the given start days, by a full walk (debug cross-check)
+        shapeById = SoftModuleInfo.shapeById
+        taskIdById = SoftModuleInfo.taskIdById
+        ueWeights = SoftModuleInfo.ueWeights
         weightedDelay = 0
-        for (startSymb, shapeId) in zip(shape["s"], shape["id"]):
-            shapeInfo = SoftModuleInfo.getShapeInfoById(shapeId)
-            width = shapeInfo["w"]
-            ueId = int(shapeId.split("-")[0])
-            weight = SoftModuleInfo.ueWeights[ueId]
+        for (startSymb, shapeId) in zip(starts, shapeIds):
+            width = shapeById[shapeId]["w"]
+            weight = ueWeights[taskIdById[shapeId]]
             weightedDelay = weightedDelay + weight * (startSymb + width)
-        shape["wd"] = weightedDelay
+        return weightedDelay
 
     @overrides(TreeNode)
     def getNumOfShapeToCachePerNode(self):
         return self._leftNode.getNumOfShapeToCachePerNode() \
-               + self._rightNode.getNumOfShapeToCachePerNode() + '{}-'.format(len(self.costs))
+               + self._rightNode.getNumOfShapeToCachePerNode() + '{}-'.format(0 if self.shapes is None else len(self.shapes))
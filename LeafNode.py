@@ -1,12 +1,14 @@
 from TreeNode import TreeNode
 from Utilities import overrides
 from SoftModuleInfo import SoftModuleInfo
+from SubtreeShapeCache import SubtreeShapeCache
 
 
 class LeafNode(TreeNode):
 
     def __init__(self, tag, tree):
         super(LeafNode, self).__init__(tag, tree)
+        self.signatureId = SubtreeShapeCache.signatureIdOf(tag)
 
     @overrides(TreeNode)
     def getNumOfShapeToEvaluate(self):
@@ -34,5 +36,5 @@ class LeafNode(TreeNode):
 
     @overrides(TreeNode)
     def getNumOfShapeToCachePerNode(self):
-        return '{}-'.format(len(self.shapes))
+        return '{}-'.format(0 if self.shapes is None else len(self.shapes))
 
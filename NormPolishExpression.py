@@ -1,99 +1,248 @@
-import copy
+from array import array
+from collections import namedtuple
+import enum
 import numpy as np
 from NodeTag import NodeTag
+from IndexedSet import IndexedSet
 
 
 class NormPolishExpression:
+    # Operands (task ids) are stored as themselves and the operators as negative codes, in one compact int array.
+    # Alongside it, the expression maintains the indices the perturbations and their checks need, and updates them
+    # locally when a perturbation changes the expression:
+    #   _prefixOps[k]       number of operators in [0, k), so a balloting check is O(1)
+    #   _operandPositions   position of the k-th operand, with _operandRankAt as its inverse (-1 at operators)
+    #   _chainStarts        positions of operators preceded by an operand
+    #   _operandOperators   positions i of an operand followed by an operator at i + 1
+    #   _operatorOperands   positions i of an operator followed by an operand at i + 1
+    #   _validSwaps         positions i where swapping i and i + 1 is a valid operand/operator swap (M3)
+    class MoveOperation(enum.Enum):
+        SwapTwoAdjacentOperands = 0
+        InvertChain = 1
+        SwapTwoAdjacentOperandsOperators = 2
+
+    # A perturbation, applied in place by applyMove(). Every move is its own inverse, see undoMove().
+    Move = namedtuple('Move', ['operation', 'index', 'otherIndex'])
+
+    CodeOfF = -1
+    CodeOfT = -2
+    _tagOfCode = {CodeOfF: 'F', CodeOfT: 'T'}
+    _codeOfTag = {'F': CodeOfF, 'T': CodeOfT}
+
+    @staticmethod
+    def encodeTag(tag):
+        return NormPolishExpression._codeOfTag[tag] if NodeTag.isOperator(tag) else tag
 
     @staticmethod
-    def _isViolatingBallotingIfSwap(expression, indexOfOperator):  # indexOfOperator must be pointed to an operator
-        assert (NodeTag.isOperator(expression[indexOfOperator]))
+    def decodeTag(code):
+        return code if code >= 0 else NormPolishExpression._tagOfCode[code]
+
+    def _isViolatingBallotingIfSwap(self, indexOfOperator):  # indexOfOperator must be pointed to an operator
+        assert (self._codes[indexOfOperator] < 0)
         p = indexOfOperator
-        Np = sum([NodeTag.isOperator(expression[i]) for i in range(0, indexOfOperator)]) + 1
+        Np = self._prefixOps[indexOfOperator] + 1
         if 2 * Np < p:
             return False
         else:
             return True
 
-    def __init__(self, expression):  # must be a list?
-        self._expression = expression
+    def __init__(self, expression):  # any sequence of operands and 'F'/'T'
+        self._codes = array('i', [NormPolishExpression.encodeTag(tag) for tag in expression])
+        self._buildIndices()
+
+    def _buildIndices(self):
+        codes = self._codes
+        length = len(codes)
+        self._prefixOps = array('i', [0]) * (length + 1)
+        self._operandPositions = array('i')
+        self._operandRankAt = array('i', [-1]) * length
+        for (index, code) in enumerate(codes):
+            if code < 0:
+                self._prefixOps[index + 1] = self._prefixOps[index] + 1
+            else:
+                self._prefixOps[index + 1] = self._prefixOps[index]
+                self._operandRankAt[index] = len(self._operandPositions)
+                self._operandPositions.append(index)
+        self._chainStarts = IndexedSet()
+        self._operandOperators = IndexedSet()
+        self._operatorOperands = IndexedSet()
+        self._validSwaps = IndexedSet()
+        self._refreshLocalIndices(0, length)
+        self._isFullUnique = None
+
+    def _refreshLocalIndices(self, low, high):
+        # recompute the membership of the positions in [low, high) in the position sets
+        codes = self._codes
+        length = len(codes)
+        for index in range(max(low, 0), min(high, length)):
+            isOperator = codes[index] < 0
+            if index > 0 and isOperator and codes[index - 1] >= 0:
+                self._chainStarts.add(index)
+            else:
+                self._chainStarts.discard(index)
+            if index + 1 < length and not isOperator and codes[index + 1] < 0:
+                self._operandOperators.add(index)
+            else:
+                self._operandOperators.discard(index)
+            if index + 1 < length and isOperator and codes[index + 1] >= 0:
+                self._operatorOperands.add(index)
+            else:
+                self._operatorOperands.discard(index)
+            if self._isValidSwap(index):
+                self._validSwaps.add(index)
+            else:
+                self._validSwaps.discard(index)
+
+    def _isValidSwap(self, index):
+        # the M3 swap of index and index + 1 keeps the expression normalized and satisfies the balloting property
+        codes = self._codes
+        if index + 2 >= len(codes):  # the last tag is always an operator, nothing to swap it with
+            return False
+        if codes[index] >= 0:
+            return index > 0 and codes[index + 1] < 0 and codes[index - 1] != codes[index + 1] \
+                and not self._isViolatingBallotingIfSwap(index + 1)
+        return codes[index + 1] >= 0 and codes[index] != codes[index + 2]
+
+    def _copy(self):
+        duplicate = NormPolishExpression.__new__(NormPolishExpression)
+        duplicate._codes = array('i', self._codes)
+        duplicate._prefixOps = array('i', self._prefixOps)
+        duplicate._operandPositions = array('i', self._operandPositions)
+        duplicate._operandRankAt = array('i', self._operandRankAt)
+        duplicate._chainStarts = self._chainStarts.copy()
+        duplicate._operandOperators = self._operandOperators.copy()
+        duplicate._operatorOperands = self._operatorOperands.copy()
+        duplicate._validSwaps = self._validSwaps.copy()
+        duplicate._isFullUnique = self._isFullUnique
+        return duplicate
+
+    def _swapOperands(self, index_i, index_j):  # both operands: the operator layout and all indices are unchanged
+        codes = self._codes
+        codes[index_i], codes[index_j] = codes[index_j], codes[index_i]
+
+    def _invertChain(self, chainStartIndex):  # operators only change type: only the M3 validity around it changes
+        codes = self._codes
+        index = chainStartIndex
+        while index < len(codes) and codes[index] < 0:
+            codes[index] = NormPolishExpression.CodeOfF + NormPolishExpression.CodeOfT - codes[index]
+            index = index + 1
+        self._refreshLocalIndices(chainStartIndex - 2, index + 1)
+        self._isFullUnique = None
+
+    def _swapAdjacentOperandAndOperator(self, index):  # one of index, index + 1 is an operand, the other an operator
+        codes = self._codes
+        codes[index], codes[index + 1] = codes[index + 1], codes[index]
+        self._prefixOps[index + 1] = self._prefixOps[index] + (1 if codes[index] < 0 else 0)
+        (operandFrom, operandTo) = (index + 1, index) if codes[index] >= 0 else (index, index + 1)
+        rank = self._operandRankAt[operandFrom]
+        self._operandPositions[rank] = operandTo
+        self._operandRankAt[operandTo] = rank
+        self._operandRankAt[operandFrom] = -1
+        self._refreshLocalIndices(index - 2, index + 3)
+        self._isFullUnique = None
+
+    def toKey(self):  # canonical immutable encoding, used as the key of the solution cache
+        return self._codes.tobytes()
 
     def numOfTask(self):
-        return sum([NodeTag.isOperand(x) for x in self._expression])
+        return len(self._operandPositions)
 
     def getExpressionInfoCompactFormat(self):
-        return ''.join(["{}-".format(self._expression[i]) for i in range(len(self._expression) - 1)]) + "{}".format(self._expression[-1])
+        return '-'.join([str(tag) for tag in self])
 
     def isValid(self):
         return self._checkBallotingProperty()
 
+    def _checkBallotingProperty(self):
+        # every prefix holds more operands than operators, and the whole expression exactly one more
+        prefixOps = self._prefixOps
+        for length in range(1, len(self._codes) + 1):
+            if 2 * prefixOps[length] >= length:
+                return False
+        return 2 * prefixOps[-1] + 1 == len(self._codes)
+
+    def __len__(self):
+        return len(self._codes)
+
     def __iter__(self):
-        return iter(self._expression)
+        tagOfCode = NormPolishExpression._tagOfCode
+        return iter([code if code >= 0 else tagOfCode[code] for code in self._codes])
 
     def isFullUnqiueExpression(self):
         # unique form like, 0, 1, F, 2, F, 3, F, 4, F, 5, F
-        if len(self._expression) <= 2:
+        if self._isFullUnique is None:
+            self._isFullUnique = self._computeIsFullUniqueExpression()
+        return self._isFullUnique
+
+    def _computeIsFullUniqueExpression(self):
+        codes = self._codes
+        if len(codes) <= 2:
             return False
-        uniqueLabel = self._expression[2]
-        for index in range(2, len(self._expression), 2):
-            if not NodeTag.isSameTag(uniqueLabel, self._expression[index]):
+        uniqueLabel = codes[2]
+        for index in range(2, len(codes), 2):
+            if uniqueLabel != codes[index]:
                 return False
-        for index in range(1, len(self._expression), 2):
-            if not NodeTag.isOperand(self._expression[index]):
+        for index in range(1, len(codes), 2):
+            if codes[index] < 0:
                 return False
         return True
 
+    def copy(self):
+        return self._copy()
+
+    def applyMove(self, move):
+        if move.operation is NormPolishExpression.MoveOperation.SwapTwoAdjacentOperands:
+            self._swapOperands(move.index, move.otherIndex)
+        elif move.operation is NormPolishExpression.MoveOperation.InvertChain:
+            self._invertChain(move.index)
+        else:
+            self._swapAdjacentOperandAndOperator(move.index)
+
+    def undoMove(self, move):
+        # swapping the same two positions again, or inverting the same chain again, restores the expression
+        self.applyMove(move)
+
+    def sampleSwapTwoAdjacentOperands(self):
+        operandPositions = self._operandPositions
+        randomInt = np.random.randint(0, len(operandPositions))
+        return NormPolishExpression.Move(NormPolishExpression.MoveOperation.SwapTwoAdjacentOperands,
+                                         operandPositions[randomInt],
+                                         operandPositions[(randomInt + 1) % len(operandPositions)])
+
+    def sampleInvertChain(self):
+        chainStartIndex = self._chainStarts[np.random.randint(0, len(self._chainStarts))]
+        return NormPolishExpression.Move(NormPolishExpression.MoveOperation.InvertChain, chainStartIndex, None)
+
+    def sampleSwapTwoAdjacentOperandsOperators(self):
+        # only currently valid M3 positions are drawn, so the move never fails; None if there is none,
+        # e.g. for the full unique form 0, 1, F, 2, F, 3, F, ...
+        if len(self._validSwaps) == 0:
+            return None
+        index = self._validSwaps[np.random.randint(0, len(self._validSwaps))]
+        return NormPolishExpression.Move(NormPolishExpression.MoveOperation.SwapTwoAdjacentOperandsOperators,
+                                         index, index + 1)
+
+    def _neighbor(self, move):
+        newExpression = self._copy()
+        newExpression.applyMove(move)
+        return newExpression
+
     def randomlySwapTwoAdjacentOperands(self):
-        newExpression = copy.deepcopy(self._expression)
-        leafIndices = [index for index in range(len(newExpression))
-                       if NodeTag.isOperand(newExpression[index])]
-        randomInt = np.random.randint(0, len(leafIndices))
-        swapIndex_i = leafIndices[randomInt]
-        swapIndex_ip1 = leafIndices[(randomInt + 1) % len(leafIndices)]
-        newExpression[swapIndex_i], newExpression[swapIndex_ip1] = newExpression[swapIndex_ip1], newExpression[
-            swapIndex_i]
-        return NormPolishExpression(newExpression)
+        return self._neighbor(self.sampleSwapTwoAdjacentOperands())
 
     def randomlyInvertChain(self):
-        newExpression = copy.deepcopy(self._expression)
-        chainStartIndices = [index for index in range(len(newExpression))
-                             if
-                             NodeTag.isOperator(newExpression[index]) and NodeTag.isOperand(newExpression[index - 1])]
-        randomInt = np.random.randint(0, len(chainStartIndices))
-        chainStartIndex = chainStartIndices[randomInt]
-        while chainStartIndex < len(newExpression):
-            if NodeTag.isOperand(newExpression[chainStartIndex]):
-                break
-            newExpression[chainStartIndex] = NodeTag.invertTag(newExpression[chainStartIndex])
-            chainStartIndex = chainStartIndex + 1
-        return NormPolishExpression(newExpression)
+        return self._neighbor(self.sampleInvertChain())
 
     def testSwapTwoAdjacentOperandOperator(self):
-        newExpression = copy.deepcopy(self._expression)
-        indicesOfOperandFollowedByOperator = [index for index in range(len(newExpression) - 1)
-                                              if NodeTag.isOperand(newExpression[index])
-                                              and NodeTag.isOperator(newExpression[index + 1])]
-        indexOfOperand = indicesOfOperandFollowedByOperator[
-            np.random.randint(0, len(indicesOfOperandFollowedByOperator))]
-        indexOfOperator = indexOfOperand + 1
-        if not NodeTag.isSameTag(newExpression[indexOfOperand - 1], newExpression[indexOfOperand + 1]):
-            violated = NormPolishExpression._isViolatingBallotingIfSwap(newExpression, indexOfOperator)
-            if not violated:
-                newExpression[indexOfOperand], newExpression[indexOfOperator] = \
-                    newExpression[indexOfOperator], newExpression[indexOfOperand]
-                return True, NormPolishExpression(newExpression)
+        indexOfOperand = self._operandOperators[np.random.randint(0, len(self._operandOperators))]
+        if indexOfOperand in self._validSwaps:
+            return True, self._neighbor(NormPolishExpression.Move(
+                NormPolishExpression.MoveOperation.SwapTwoAdjacentOperandsOperators, indexOfOperand, indexOfOperand + 1))
         return False, None
 
     def testSwapTwoAdjacentOperatorAndOperand(self):
-        newExpression = copy.deepcopy(self._expression)
-        indicesOfOperatorFollowedByOperand = [index for index in range(len(newExpression) - 1)
-                                              if NodeTag.isOperator(newExpression[index])
-                                              and NodeTag.isOperand(newExpression[index + 1])]
-        indexOfOperator = indicesOfOperatorFollowedByOperand[np.random.randint(0, len(indicesOfOperatorFollowedByOperand))]
-        indexOfOperand = indexOfOperator + 1
-        if not NodeTag.isSameTag(newExpression[indexOfOperator], newExpression[indexOfOperator + 2]):
-            newExpression[indexOfOperator], newExpression[indexOfOperand] = \
-                newExpression[indexOfOperand], newExpression[indexOfOperator]
-            return True, NormPolishExpression(newExpression)
+        indexOfOperator = self._operatorOperands[np.random.randint(0, len(self._operatorOperands))]
+        if indexOfOperator in self._validSwaps:
+            return True, self._neighbor(NormPolishExpression.Move(
+                NormPolishExpression.MoveOperation.SwapTwoAdjacentOperandsOperators, indexOfOperator, indexOfOperator + 1))
         return False, None
-
@@ -0,0 +1,68 @@
+import math
+import numpy as np
+
+
+class OnlineStatistics:
+    # Streaming count, mean and variance (Welford), running min/max and an optional fixed-size uniform reservoir
+    # of the samples (Algorithm R), in constant memory and O(1) per sample.
+
+    def __init__(self, reservoirSize=0, seed=None):
+        self.count = 0
+        self.mean = 0.0
+        self._sumOfSquaredDeviations = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._reservoirSize = reservoirSize
+        self._reservoir = []
+        self._random = np.random.RandomState(seed) if reservoirSize > 0 else None
+
+    def add(self, sample):
+        self.count = self.count + 1
+        delta = sample - self.mean
+        self.mean = self.mean + delta / self.count
+        self._sumOfSquaredDeviations = self._sumOfSquaredDeviations + delta * (sample - self.mean)
+        if sample < self.min:
+            self.min = sample
+        if sample > self.max:
+            self.max = sample
+        if self._reservoirSize > 0:
+            if len(self._reservoir) < self._reservoirSize:
+                self._reservoir.append(sample)
+            else:
+                index = self._random.randint(0, self.count)
+                if index < self._reservoirSize:
+                    self._reservoir[index] = sample
+
+    def variance(self):  # sample variance, as statistics.variance
+        if self.count < 2:
+            return 0.0
+        return self._sumOfSquaredDeviations / (self.count - 1)
+
+    def stdDeviation(self):
+        return math.sqrt(self.variance())
+
+    def reservoir(self):
+        return list(self._reservoir)
+
+    def merge(self, other):
+        # Adds the samples summarized by other (Chan et al. for mean and variance). The merged reservoir draws
+        # from both reservoirs in proportion to the sample counts they stand for.
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self._sumOfSquaredDeviations = self._sumOfSquaredDeviations + other._sumOfSquaredDeviations \
+            + delta * delta * self.count * other.count / count
+        self.mean = self.mean + delta * other.count / count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        if self._reservoirSize > 0:
+            candidates = self._reservoir + other._reservoir
+            weights = [1.0 * self.count / max(len(self._reservoir), 1)] * len(self._reservoir) \
+                + [1.0 * other.count / max(len(other._reservoir), 1)] * len(other._reservoir)
+            if len(candidates) > self._reservoirSize:
+                probabilities = np.array(weights) / sum(weights)
+                chosen = self._random.choice(len(candidates), size=self._reservoirSize, replace=False, p=probabilities)
+                candidates = [candidates[index] for index in sorted(chosen)]
+            self._reservoir = candidates
+        self.count = count
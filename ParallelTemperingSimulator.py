@@ -0,0 +1,177 @@
+import numpy as np
+import math
+import multiprocessing
+import os
+from OnlineStatistics import OnlineStatistics
+from AnnealingSimulator import AnnealingSimulator
+from NormPolishExpression import NormPolishExpression
+from SkewedSlicingTree import SkewedSlicingTree
+from SlicingTreeSolutionCache import SlicingTreeSolutionCache
+from SubtreeShapeCache import SubtreeShapeCache
+from SoftModuleInfo import SoftModuleInfo
+from WorkerContext import WorkerContext
+from Parameters import Parameters
+from Utilities import LOG
+
+
+# Replica exchange (parallel tempering): numOfReplicas Markov chains run at a geometric ladder of fixed
+# temperatures, each for numIterationPerExchange steps in a worker process, and then neighboring temperatures
+# swap their states with probability min(1, exp((1/Ti - 1/Tj) * (Ei - Ej))).
+class ParallelTemperingSimulator:
+
+    def __init__(self):
+        self._startExpression = None
+        self._minimumDelay = float('inf')
+        self._bestShapeSolution = None
+        self._bestExpression = None
+        self._terminateReason = AnnealingSimulator.TerminateReason.EndOfReason
+
+        self._numOfReplicas = 4
+        self._minTemperature = 1.0
+        self._maxTemperature = 100.0
+        self._numIterationPerExchange = 100
+        self._maxExchangeCount = 50
+        self._numOfProcesses = None  # None: one per replica, capped by the number of cores; 1: run in this process
+
+        self._randomSeed = 100
+
+        self._delayStatistics = OnlineStatistics(Parameters.delaySampleReservoirSize, self._randomSeed)
+        self._cacheHitRate = 0
+        self._numOfExchangeAttempts = 0
+        self._numOfExchangeAccepts = 0
+
+    def setStartExpression(self, startExpr):
+        self._startExpression = NormPolishExpression(startExpr)
+
+    def setRandomSeed(self, seed):
+        self._randomSeed = seed
+
+    def setNumOfReplicas(self, num):
+        self._numOfReplicas = num
+
+    def setTemperatureRange(self, minTemperature, maxTemperature):
+        self._minTemperature = minTemperature
+        self._maxTemperature = maxTemperature
+
+    def setNumIterationPerExchange(self, num):
+        self._numIterationPerExchange = num
+
+    def setMaxExchangeCount(self, count):
+        self._maxExchangeCount = count
+
+    def setNumOfProcesses(self, num):
+        self._numOfProcesses = num
+
+    def temperatureLadder(self):
+        if self._numOfReplicas == 1:
+            return [self._minTemperature]
+        ratio = (self._maxTemperature / self._minTemperature) ** (1.0 / (self._numOfReplicas - 1))
+        return [self._minTemperature * ratio ** replica for replica in range(self._numOfReplicas)]
+
+    def solutionResult(self):
+        return {"bestExpression": self._bestExpression,
+                "bestShapes": self._bestShapeSolution,
+                "minimumDelay": self._minimumDelay,
+                "delayMean": 0 if self._delayStatistics.count < 1 else self._delayStatistics.mean,
+                "delayStdVariance": 0 if self._delayStatistics.count < 2 else self._delayStatistics.stdDeviation(),
+                "delayMin": 0 if self._delayStatistics.count < 1 else self._delayStatistics.min,
+                "delayMax": 0 if self._delayStatistics.count < 1 else self._delayStatistics.max,
+                "cacheHitRate": self._cacheHitRate,
+                "terminateReason": self._terminateReason.value,
+                "exchangeAcceptRate": 0 if self._numOfExchangeAttempts == 0 else
+                1.0 * self._numOfExchangeAccepts / self._numOfExchangeAttempts}
+
+    @staticmethod
+    def _stateDelay(simulator, expression):
+        # energy of a replica state: its minimum delay, or the simulator's heuristic delay if it is not a solution
+        slicingTree = SkewedSlicingTree(expression)
+        if slicingTree.satisfyFeatureSpecificConstraints(Parameters.featureConstrain):
+            slicingTree.evaluate()
+            if slicingTree.isSolvable():
+                return slicingTree.getMinimumDelay()
+        return simulator.getHeuristicDelay()
+
+    @staticmethod
+    def _runReplicaSegment(segment):
+        # runs in a worker: one replica at its fixed temperature for numOfIterations steps
+        (expressionTags, currentDelay, temperature, numOfIterations, seed) = segment
+        simulator = AnnealingSimulator()
+        simulator.setRandomSeed(seed)
+        simulator.setStartExpression(expressionTags)
+        expression = simulator._startExpression.copy()
+        if currentDelay is None:
+            currentDelay = ParallelTemperingSimulator._stateDelay(simulator, expression)
+        (currentDelay, reject, hitCacheCount, numOfTreeEvaluate) = simulator._anneal(
+            expression, currentDelay, temperature, numOfIterations)
+        result = simulator.solutionResult()
+        return {"expression": list(expression),
+                "currentDelay": currentDelay,
+                "bestExpression": None if result["bestExpression"] is None else list(result["bestExpression"]),
+                "bestShapes": result["bestShapes"],
+                "minimumDelay": result["minimumDelay"],
+                "delayStatistics": simulator.delayStatistics(),
+                "hitCacheCount": hitCacheCount,
+                "numOfTreeEvaluate": numOfTreeEvaluate}
+
+    def _segmentSeed(self, exchangeCount, replica):
+        return int(np.random.SeedSequence([self._randomSeed, exchangeCount, replica]).generate_state(1)[0])
+
+    def _exchange(self, temperatures, states, delays, exchangeCount, random):
+        # alternate between the even and the odd pairs of neighboring temperatures
+        for coldReplica in range(exchangeCount % 2, len(temperatures) - 1, 2):
+            hotReplica = coldReplica + 1
+            self._numOfExchangeAttempts = self._numOfExchangeAttempts + 1
+            exponent = (1.0 / temperatures[coldReplica] - 1.0 / temperatures[hotReplica]) \
+                * (delays[coldReplica] - delays[hotReplica])
+            if exponent >= 0 or random.random_sample() < math.exp(exponent):
+                self._numOfExchangeAccepts = self._numOfExchangeAccepts + 1
+                states[coldReplica], states[hotReplica] = states[hotReplica], states[coldReplica]
+                delays[coldReplica], delays[hotReplica] = delays[hotReplica], delays[coldReplica]
+
+    def _collect(self, results):
+        hitCacheCount = 0
+        numOfTreeEvaluate = 0
+        for result in results:
+            self._delayStatistics.merge(result["delayStatistics"])
+            hitCacheCount = hitCacheCount + result["hitCacheCount"]
+            numOfTreeEvaluate = numOfTreeEvaluate + result["numOfTreeEvaluate"]
+            if result["bestExpression"] is not None and result["minimumDelay"] < self._minimumDelay:
+                self._minimumDelay = result["minimumDelay"]
+                self._bestShapeSolution = result["bestShapes"]
+                self._bestExpression = NormPolishExpression(result["bestExpression"])
+        self._cacheHitRate = 1.0 * hitCacheCount / max(numOfTreeEvaluate, 1)
+
+    def runSimulation(self):
+        temperatures = self.temperatureLadder()
+        states = [list(self._startExpression) for temperature in temperatures]
+        delays = [None for temperature in temperatures]  # evaluated by the workers in the first round
+        random = np.random.RandomState(self._randomSeed)
+        if not SoftModuleInfo.isSweepMode():
+            SlicingTreeSolutionCache.reset()
+            SubtreeShapeCache.reset()
+
+        numOfProcesses = self._numOfProcesses
+        if numOfProcesses is None:
+            numOfProcesses = min(len(temperatures), os.cpu_count() or 1)
+        pool = None
+        if numOfProcesses > 1:
+            pool = multiprocessing.Pool(processes=numOfProcesses, initializer=WorkerContext.restore,
+                                        initargs=(WorkerContext.capture(), ))
+        try:
+            for exchangeCount in range(self._maxExchangeCount):
+                segments = [(states[replica], delays[replica], temperatures[replica], self._numIterationPerExchange,
+                             self._segmentSeed(exchangeCount, replica)) for replica in range(len(temperatures))]
+                if pool is None:
+                    results = [ParallelTemperingSimulator._runReplicaSegment(segment) for segment in segments]
+                else:
+                    results = pool.map(ParallelTemperingSimulator._runReplicaSegment, segments)
+                states = [result["expression"] for result in results]
+                delays = [result["currentDelay"] for result in results]
+                self._collect(results)
+                LOG("{} exchange, minimum delay = {}, replica delays = {}", 0, exchangeCount, self._minimumDelay, delays)
+                self._exchange(temperatures, states, delays, exchangeCount, random)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        self._terminateReason = AnnealingSimulator.TerminateReason.MaxAnnealCountReached
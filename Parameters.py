@@ -19,19 +19,39 @@ class Parameters:
         ReciprocalOfResourceElementNumber = 2
 
     reservedNumPrbPerUe = 1.0
+    delaySampleReservoirSize = 0  # 0: delay samples are only summarized, >0: also keep a uniform sample of them
+    toProfilePhases = False  # record per-phase timers and counters in PhaseProfiler, see solutionResult()["profile"]
+    logLevel = 1  # LOG prints the messages of this level and above: 0 debug traces, 1 progress, 2 silent
     simCount = 1
     numOfPRBNumToSim = 10
     toUseWeightedDelayAsCost = False
     featureConstrain = FeatureConstrains.ETaskPrecedence
     perturbOperationSelectionRule = PerturbOperationSelectionRules.Randomly
+    slicingTreeExpressionKeyType = SlicingTreeExpressionKeyTypes.PostOrderFullForChannelAwared
+    solutionCacheMaxEntries = 200000  # None: no limit on the number of cached tree solutions
+    solutionCacheMaxBytes = 256 * 1024 * 1024  # None: no limit on the estimated memory of cached tree solutions
+    toVerifyShapeImmutability = False  # debug: build shapes as read-only dicts, so that any write raises
+    minShapeCombinationsToVectorize = 64  # smaller left x right products are combined without NumPy
+    toMemoizeSubtreeShapes = True  # reuse the shapes of unchanged subtrees between neighbor trees
+    subtreeShapeCacheMaxEntries = 200000  # None: no limit on the number of memoized subtree shape lists
+    subtreeSignatureMaxEntries = 1000000  # None: no limit on the number of interned subtree signatures
+    toVerifyWeightedDelay = False  # debug: check the incremental wd of every combined shape against a full walk
+    toFilterPrecedenceInSubtrees = True  # ETaskPrecedence: drop infeasible partial shapes before each node's pruning
 
     @staticmethod
     def paramsDescriptions():
         return 'simCount = {}\n' \
                'toUseWeightedDelayAsCost = {}\n' \
                'featureConstrain = {}\n' \
-               'perturbOperationSelectionRule = {}\n'.format(Parameters.simCount,
-                                                             Parameters.toUseWeightedDelayAsCost,
-                                                             Parameters.FeatureConstrains(Parameters.featureConstrain),
-                                                             Parameters.PerturbOperationSelectionRules(
-                                                                 Parameters.perturbOperationSelectionRule))
+               'perturbOperationSelectionRule = {}\n' \
+               'slicingTreeExpressionKeyType = {}\n' \
+               'solutionCacheMaxEntries = {}\n' \
+               'solutionCacheMaxBytes = {}\n'.format(Parameters.simCount,
+                                                     Parameters.toUseWeightedDelayAsCost,
+                                                     Parameters.FeatureConstrains(Parameters.featureConstrain),
+                                                     Parameters.PerturbOperationSelectionRules(
+                                                         Parameters.perturbOperationSelectionRule),
+                                                     Parameters.SlicingTreeExpressionKeyTypes(
+                                                         Parameters.slicingTreeExpressionKeyType),
+                                                     Parameters.solutionCacheMaxEntries,
+                                                     Parameters.solutionCacheMaxBytes)
@@ -0,0 +1,38 @@
+
+class ParetoFront:
+
+    @staticmethod
+    def prune(costs, widths, heights):
+        # Indices of the non-dominated items, in ascending cost order (stable on ties). An item is dropped when an
+        # item before it in that order is no wider and no higher, i.e. it is dominated on (cost, w, h).
+        order = sorted(range(len(costs)), key=costs.__getitem__)
+        keptInOrder = ParetoFront.pruneSorted([widths[index] for index in order],
+                                              [heights[index] for index in order])
+        return [order[index] for index in keptInOrder]
+
+    @staticmethod
+    def pruneSorted(widths, heights):
+        # Same as prune() for items already sorted by cost. A Fenwick tree over the distinct widths holds, for every
+        # width, the minimum height among the items kept so far, so each dominance query is O(log n): O(n log n).
+        distinctWidths = sorted(set(widths))
+        rankOfWidth = {width: rank + 1 for (rank, width) in enumerate(distinctWidths)}
+        size = len(distinctWidths)
+        minHeights = [float('inf')] * (size + 1)
+        kept = []
+        for (index, (width, height)) in enumerate(zip(widths, heights)):
+            rank = rankOfWidth[width]
+            position = rank
+            lowestHeight = float('inf')
+            while position > 0:  # minimum height among kept items no wider than this one
+                if minHeights[position] < lowestHeight:
+                    lowestHeight = minHeights[position]
+                position -= position & (-position)
+            if lowestHeight <= height:
+                continue
+            kept.append(index)
+            position = rank
+            while position <= size:
+                if height < minHeights[position]:
+                    minHeights[position] = height
+                position += position & (-position)
+        return kept
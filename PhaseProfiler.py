@@ -0,0 +1,69 @@
+import time
+
+
+class PhaseProfiler:
+    # Nested wall-clock timers and plain counters for the phases of a run, recorded while
+    # Parameters.toProfilePhases is set. Call sites check the flag before start()/stop(), so a disabled profiler
+    # costs one attribute lookup per phase. Times are keyed by the stack of open phases, e.g.
+    # ("runSimulation", "anneal", "evaluate", "combine"), which is what collapsedStacks() exports.
+
+    _stack = []  # [phase key, start time, time spent in child phases]
+    totalSeconds = {}  # phase key -> seconds including child phases
+    selfSeconds = {}  # phase key -> seconds excluding child phases
+    calls = {}  # phase key -> number of start()/stop() pairs
+    counters = {}  # counter name -> value
+    maxima = {}  # counter name -> largest value passed to observeMax()
+
+    @staticmethod
+    def reset():
+        PhaseProfiler._stack = []
+        PhaseProfiler.totalSeconds = {}
+        PhaseProfiler.selfSeconds = {}
+        PhaseProfiler.calls = {}
+        PhaseProfiler.counters = {}
+        PhaseProfiler.maxima = {}
+
+    @staticmethod
+    def start(phase):
+        stack = PhaseProfiler._stack
+        key = (phase, ) if len(stack) == 0 else stack[-1][0] + (phase, )
+        stack.append([key, time.perf_counter(), 0.0])
+
+    @staticmethod
+    def stop():
+        (key, startTime, childSeconds) = PhaseProfiler._stack.pop()
+        elapsed = time.perf_counter() - startTime
+        PhaseProfiler.totalSeconds[key] = PhaseProfiler.totalSeconds.get(key, 0.0) + elapsed
+        PhaseProfiler.selfSeconds[key] = PhaseProfiler.selfSeconds.get(key, 0.0) + elapsed - childSeconds
+        PhaseProfiler.calls[key] = PhaseProfiler.calls.get(key, 0) + 1
+        if len(PhaseProfiler._stack) > 0:
+            PhaseProfiler._stack[-1][2] += elapsed
+
+    @staticmethod
+    def count(name, value=1):
+        PhaseProfiler.counters[name] = PhaseProfiler.counters.get(name, 0) + value
+
+    @staticmethod
+    def observeMax(name, value):
+        if value > PhaseProfiler.maxima.get(name, value - 1):
+            PhaseProfiler.maxima[name] = value
+
+    @staticmethod
+    def report():
+        # phases as "a;b;c" paths, the form used by solutionResult()
+        return {"seconds": {";".join(key): seconds for (key, seconds) in PhaseProfiler.totalSeconds.items()},
+                "selfSeconds": {";".join(key): seconds for (key, seconds) in PhaseProfiler.selfSeconds.items()},
+                "calls": {";".join(key): calls for (key, calls) in PhaseProfiler.calls.items()},
+                "counters": dict(PhaseProfiler.counters),
+                "maxima": dict(PhaseProfiler.maxima)}
+
+    @staticmethod
+    def collapsedStacks():
+        # one "a;b;c <self time in microseconds>" line per phase stack, the input format of flamegraph.pl
+        return "".join(["{} {}\n".format(";".join(key), int(round(seconds * 1e6)))
+                        for (key, seconds) in sorted(PhaseProfiler.selfSeconds.items())])
+
+    @staticmethod
+    def writeCollapsedStacks(path):
+        with open(path, "w") as file:
+            file.write(PhaseProfiler.collapsedStacks())
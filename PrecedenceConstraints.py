@@ -0,0 +1,136 @@
+import numpy as np
+from SoftModuleInfo import SoftModuleInfo
+from Parameters import Parameters
+
+
+class PrecedenceConstraints:
+    # Compiled precedence DAG and mutual-exclusion groups over task ids.
+    #   precedences: (before, after) pairs, task `after` may not start before task `before` completes
+    #   exclusiveGroups: lists of task ids whose [start, completion) intervals must not overlap pairwise
+    # A task occupies the days [s, s + w) of its shape. Constraints that involve a task missing from a (partial)
+    # schedule are not checked, so a subtree's shapes can be checked against the tasks they already place.
+
+    _perUnitTemplates = {}  # numOfTasks -> default template, see active()
+
+    def __init__(self, precedences=(), exclusiveGroups=()):
+        self.precedences = [(int(before), int(after)) for (before, after) in precedences]
+        self.exclusiveGroups = [sorted(set([int(taskId) for taskId in group])) for group in exclusiveGroups]
+        self.exclusiveGroups = [group for group in self.exclusiveGroups if len(group) > 1]
+        taskIds = [taskId for edge in self.precedences for taskId in edge] \
+            + [taskId for group in self.exclusiveGroups for taskId in group]
+        self._numOfTasks = 0 if len(taskIds) == 0 else max(taskIds) + 1
+        self._before = np.array([before for (before, after) in self.precedences], dtype=np.int64)
+        self._after = np.array([after for (before, after) in self.precedences], dtype=np.int64)
+        self._groups = [np.array(group, dtype=np.int64) for group in self.exclusiveGroups]
+        if self._hasCycle():
+            raise ValueError('precedence constraints contain a cycle')
+
+    @staticmethod
+    def perUnitTemplate(numOfTasks, numOfTaskPerUnit=4):
+        # Task 0 of a unit completes before the other tasks of its unit start, and the task 0s of different units
+        # do not overlap; task ids are unit * numOfTaskPerUnit + task within unit.
+        numOfUnits = numOfTasks // numOfTaskPerUnit
+        precedences = [(numOfTaskPerUnit * unit, numOfTaskPerUnit * unit + task)
+                       for unit in range(numOfUnits) for task in range(1, numOfTaskPerUnit)]
+        firstTasks = list(range(0, numOfTasks, numOfTaskPerUnit))
+        return PrecedenceConstraints(precedences, [firstTasks])
+
+    @staticmethod
+    def active():
+        # constraints loaded with SoftModuleInfo.setPrecedenceConstraints(), or else the per-unit template of 4 tasks
+        # per unit over the tasks of the info map
+        if SoftModuleInfo.precedenceConstraints is not None:
+            return SoftModuleInfo.precedenceConstraints
+        numOfTasks = len(SoftModuleInfo.infoMap)
+        if numOfTasks not in PrecedenceConstraints._perUnitTemplates:
+            PrecedenceConstraints._perUnitTemplates[numOfTasks] = PrecedenceConstraints.perUnitTemplate(numOfTasks)
+        return PrecedenceConstraints._perUnitTemplates[numOfTasks]
+
+    def describe(self):
+        return {"precedences": [list(edge) for edge in self.precedences], "exclusiveGroups": self.exclusiveGroups}
+
+    def _hasCycle(self):
+        # Kahn's algorithm on the precedence edges
+        inDegree = [0] * self._numOfTasks
+        successors = [[] for taskId in range(self._numOfTasks)]
+        for (before, after) in self.precedences:
+            successors[before].append(after)
+            inDegree[after] = inDegree[after] + 1
+        ready = [taskId for taskId in range(self._numOfTasks) if inDegree[taskId] == 0]
+        numOfVisited = 0
+        while len(ready) > 0:
+            taskId = ready.pop()
+            numOfVisited = numOfVisited + 1
+            for successor in successors[taskId]:
+                inDegree[successor] = inDegree[successor] - 1
+                if inDegree[successor] == 0:
+                    ready.append(successor)
+        return numOfVisited < self._numOfTasks
+
+    def feasibleMask(self, taskIds, starts, completions):
+        # taskIds: the k task ids of the columns; starts, completions: (m, k) arrays, one schedule per row.
+        # Returns a bool array of m, True for the schedules that violate no constraint among their tasks.
+        if len(starts) * len(taskIds) < Parameters.minShapeCombinationsToVectorize:
+            return self._feasibleMaskScalar(taskIds, starts, completions)
+        starts = np.asarray(starts)
+        completions = np.asarray(completions)
+        feasible = np.ones(starts.shape[0], dtype=bool)
+        if self._numOfTasks == 0:
+            return feasible
+        taskIds = np.asarray(taskIds, dtype=np.int64)
+        inRange = taskIds < self._numOfTasks
+        columnOf = np.full(self._numOfTasks, -1, dtype=np.int64)
+        columnOf[taskIds[inRange]] = np.nonzero(inRange)[0]
+
+        if len(self._before) > 0:
+            beforeColumns = columnOf[self._before]
+            afterColumns = columnOf[self._after]
+            present = (beforeColumns >= 0) & (afterColumns >= 0)
+            if present.any():
+                violated = starts[:, afterColumns[present]] < completions[:, beforeColumns[present]]
+                feasible &= ~violated.any(axis=1)
+
+        for group in self._groups:
+            columns = columnOf[group]
+            columns = columns[columns >= 0]
+            if len(columns) < 2:
+                continue
+            # sort each schedule's intervals by start: one overlaps an earlier one iff it starts before the
+            # latest completion so far
+            groupStarts = starts[:, columns]
+            order = np.argsort(groupStarts, axis=1, kind='stable')
+            sortedStarts = np.take_along_axis(groupStarts, order, axis=1)
+            sortedCompletions = np.take_along_axis(completions[:, columns], order, axis=1)
+            latestCompletions = np.maximum.accumulate(sortedCompletions, axis=1)
+            feasible &= ~(sortedStarts[:, 1:] < latestCompletions[:, :-1]).any(axis=1)
+        return feasible
+
+    def _feasibleMaskScalar(self, taskIds, starts, completions):
+        # same as feasibleMask() without NumPy, for a few small schedules
+        columnOf = {taskId: column for (column, taskId) in enumerate(taskIds)}
+        edges = [(columnOf[before], columnOf[after]) for (before, after) in self.precedences
+                 if before in columnOf and after in columnOf]
+        groups = [[columnOf[taskId] for taskId in group if taskId in columnOf] for group in self.exclusiveGroups]
+        groups = [columns for columns in groups if len(columns) > 1]
+        feasible = []
+        for (rowStarts, rowCompletions) in zip(starts, completions):
+            isFeasible = all([rowStarts[after] >= rowCompletions[before] for (before, after) in edges])
+            for columns in groups:
+                if not isFeasible:
+                    break
+                latestCompletion = None
+                for (start, completion) in sorted([(rowStarts[column], rowCompletions[column]) for column in columns]):
+                    if latestCompletion is not None and start < latestCompletion:
+                        isFeasible = False
+                        break
+                    latestCompletion = completion if latestCompletion is None else max(latestCompletion, completion)
+            feasible.append(isFeasible)
+        return feasible
+
+    def isSatisfiedBy(self, shape):
+        # check one (partial) shape solution, its widths taken from the shape catalog
+        shapeById = SoftModuleInfo.shapeById
+        taskIds = [SoftModuleInfo.taskIdById[id] for id in shape["id"]]
+        starts = list(shape["s"])
+        completions = [start + shapeById[id]["w"] for (start, id) in zip(starts, shape["id"])]
+        return bool(self.feasibleMask(taskIds, [starts], [completions])[0])
@@ -24,7 +24,7 @@ class ResourceGridViewer:
             shape = SoftModuleInfo.getShapeInfoById(id)
             numDay = shape['w']
             numPerson = shape['h']
-            task_Id = int(id.split("-")[0])
+            task_Id = SoftModuleInfo.getTaskIdById(id)
             centers[task_Id] = (startDay + numDay * 1.0 / 2 - 0.5, startPerson + numPerson * 1.0 / 2 - 0.5)
             for day in range(numDay):
                 for person in range(numPerson):
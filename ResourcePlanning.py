@@ -3,13 +3,19 @@ from AnnealingSimulator import AnnealingSimulator
 from SoftModuleInfo import SoftModuleInfo
 from Utilities import LOG
 from SlicingTreeSolutionCache import SlicingTreeSolutionCache
+from SubtreeShapeCache import SubtreeShapeCache
 from ResourceGridViewer import ResourceGridViewer
+from WarmStartStore import WarmStartStore
+from PrecedenceConstraints import PrecedenceConstraints
 from Parameters import Parameters
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 
 
-def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCount=1000,
-                     numIterationPerTemperature=100):
+def solveResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCount=1000,
+                          numIterationPerTemperature=100, randomSeed=None, startExpression=None,
+                          warmStartStorePath=None, timeBudget=None):
     init_slicingPattern = "T"
     num_unit = num_of_unit
     num_task_per_unit = 4
@@ -41,6 +47,8 @@ def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCo
 
     SoftModuleInfo.setInfoMap(shapeInfoMap)
     SoftModuleInfo.setUeWeights(task_weights)
+    SoftModuleInfo.setPrecedenceConstraints(PrecedenceConstraints.perUnitTemplate(num_task_per_unit * num_unit,
+                                                                                  num_task_per_unit))
 
     SoftModuleInfo.setHmax(Hmax)
     SoftModuleInfo.setWmax(Wmax)
@@ -52,7 +60,7 @@ def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCo
     #     expressions.append(init_slicingPattern)
 
     expressions = []
-    for unit in range(num_unit):
+    for unit in range(num_unit if startExpression is None else 0):
         expressions.append(4 * unit)
         expressions.append(4 * unit + 1)
         expressions.append(4 * unit + 2)
@@ -62,18 +70,40 @@ def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCo
         expressions.append("T")
         if unit > 0:
             expressions.append("T")
+    store = None
+    if warmStartStorePath is not None:  # best expressions of earlier runs of this problem, at any capacity
+        store = WarmStartStore(warmStartStorePath)
+        fingerprint = WarmStartStore.problemFingerprint()
+        if startExpression is None:
+            startExpression = store.closestExpression(fingerprint, Hmax, Wmax)
+    if startExpression is not None:  # warm start, e.g. from the best expression found at another capacity
+        expressions = list(startExpression)
 
     simulator = AnnealingSimulator()
-    # simulator.setRandomSeed(1)
+    if randomSeed is not None:
+        simulator.setRandomSeed(randomSeed)
     simulator.setTemperatureAnnealingRate(temperatureAnnealingRate)
     simulator.setStartTemperature(startTemperature)
     simulator.setMaxAnnealingCount(maxAnnealingCount)
     simulator.setNumIterationPerTemperature(numIterationPerTemperature)
+    simulator.setTimeBudget(timeBudget)  # seconds, the best plan found so far is returned when it runs out
     simulator.setStartExpression(expressions)
     LOG("Start to run SA simulator from expression = {}".format(expressions), 1)
     simulator.runSimulation()
+    result = simulator.solutionResult()
+    if store is not None:
+        if result["bestExpression"] is not None:
+            store.record(fingerprint, Hmax, Wmax, result["bestExpression"], result["minimumDelay"])
+        store.close()
+    return result
+
 
-    finalSolution = simulator.solutionResult()
+def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCount=1000,
+                     numIterationPerTemperature=100, randomSeed=None, pngFileName=None, startExpression=None,
+                     warmStartStorePath=None, timeBudget=None):
+    finalSolution = solveResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCount,
+                                          numIterationPerTemperature, randomSeed, startExpression,
+                                          warmStartStorePath, timeBudget)
     if not finalSolution is None and not finalSolution["bestExpression"] is None:
         LOG('Slicing Tree = {}'.format(finalSolution["bestExpression"].getExpressionInfoCompactFormat()), 1)
         LOG('bestShapes = {}'.format(SkewedSlicingTree.packetSolutionInfo(finalSolution["bestShapes"])), 1)
@@ -90,7 +120,8 @@ def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCo
         bestSolution = finalSolution["bestShapes"]
 
         if not bestSolution is None:
-            pngFileName = 'best_task_schedule_grid_{}.png'.format(datetime.now().strftime("%I-%M%p-on-%B-%d-%Y"))
+            if pngFileName is None:
+                pngFileName = 'best_task_schedule_grid_{}.png'.format(datetime.now().strftime("%I-%M%p-on-%B-%d-%Y"))
             rgv.drawAndSaveResourceGridBySolution(bestSolution, pngFileName)
             return bestSolution, pngFileName
     else:
@@ -99,23 +130,114 @@ def ResourcePlanning(maximmum_persons, maximum_days, num_of_unit, maxAnnealingCo
     return None, None
 
 
+def _ResourcePlanningSweepJob(job):
+    (workers, trial, seed, maximum_days, num_of_unit, maxAnnealingCount, numIterationPerTemperature) = job
+    pngFileName = 'best_task_schedule_grid_{}_workers_{}_trial_{}.png'.format(
+        datetime.now().strftime("%I-%M%p-on-%B-%d-%Y"), workers, trial)
+    bestSolution, pngFileName = ResourcePlanning(maximmum_persons=workers, maximum_days=maximum_days,
+                                                 num_of_unit=num_of_unit, maxAnnealingCount=maxAnnealingCount,
+                                                 numIterationPerTemperature=numIterationPerTemperature,
+                                                 randomSeed=seed, pngFileName=pngFileName)
+    return workers, trial, bestSolution, pngFileName
+
+
+def ResourcePlanningSweep(possible_workers, num_of_random_trials, maximum_days, num_of_unit, maxAnnealingCount=1000,
+                          numIterationPerTemperature=100, maxProcesses=None, baseSeed=0, stopAtFirstFeasible=True):
+    # Runs the (workers x trial) solves in a process pool; every process has its own SoftModuleInfo and caches.
+    # Each job is seeded from (baseSeed, workers, trial), so results do not depend on the scheduling. With
+    # stopAtFirstFeasible, the jobs of larger worker counts are cancelled once a feasible count is found; the
+    # smaller counts still run to completion, so the returned minimum is the same as the serial sweep's.
+    worker_bestSolutions_dic = {workers: [] for workers in possible_workers}
+    minimumWorkers = None
+    with ProcessPoolExecutor(max_workers=maxProcesses) as executor:
+        futures = {}
+        for workers in possible_workers:
+            for trial in range(num_of_random_trials):
+                seed = int(np.random.SeedSequence([baseSeed, workers, trial]).generate_state(1)[0])
+                job = (workers, trial, seed, maximum_days, num_of_unit, maxAnnealingCount, numIterationPerTemperature)
+                futures[executor.submit(_ResourcePlanningSweepJob, job)] = workers
+        for future in as_completed(futures):
+            if future.cancelled():
+                continue
+            (workers, trial, bestSolution, pngFileName) = future.result()
+            print('workers = {}, trial = {}: {}'.format(workers, trial, 'found' if bestSolution is not None else '-'))
+            if bestSolution is None:
+                continue
+            worker_bestSolutions_dic[workers].append(bestSolution)
+            if minimumWorkers is None or workers < minimumWorkers:
+                minimumWorkers = workers
+                if stopAtFirstFeasible:
+                    for (other, otherWorkers) in futures.items():
+                        if otherWorkers > minimumWorkers:
+                            other.cancel()  # running jobs cannot be cancelled, their results are ignored
+    if stopAtFirstFeasible and minimumWorkers is not None:
+        worker_bestSolutions_dic = {workers: solutions for (workers, solutions) in worker_bestSolutions_dic.items()
+                                    if workers <= minimumWorkers}
+    return minimumWorkers, worker_bestSolutions_dic
+
+
+def _bisectMinimumFeasible(low, high, isFeasible):
+    # smallest capacity in [low, high] for which isFeasible holds, assuming feasibility is monotone in the
+    # capacity; None if even high is infeasible. Probes O(log(high - low)) capacities.
+    if not isFeasible(high):
+        return None
+    while low < high:
+        middle = (low + high) // 2
+        if isFeasible(middle):
+            high = middle
+        else:
+            low = middle + 1
+    return low
+
+
+def ResourcePlanningCapacitySearch(low_persons, high_persons, maximum_days, num_of_unit, maxAnnealingCount=1000,
+                                   numIterationPerTemperature=100, randomSeed=None, low_days=None):
+    # Bisects on maximmum_persons for the smallest team with a feasible plan within maximum_days; if low_days is
+    # given, it then bisects on maximum_days in [low_days, maximum_days] for that team. Every probe is one annealing
+    # run, warm-started from the best expression found at the nearest capacity probed so far. The probes evaluate
+    # fronts under the sweep bounds (high_persons, maximum_days), so an expression evaluated at one capacity is a
+    # cache hit at every other one.
+    # Returns (minimumPersons, minimumDays, probes), probes mapping (persons, days) to the solution result.
+    probes = {}
+
+    def warmStartExpression(persons, days):
+        solved = [(abs(persons - probedPersons) + abs(days - probedDays), result["bestExpression"])
+                  for ((probedPersons, probedDays), result) in probes.items() if result["bestExpression"] is not None]
+        if len(solved) == 0:
+            return None
+        return list(min(solved, key=lambda item: item[0])[1])
+
+    def isFeasible(persons, days):
+        if (persons, days) not in probes:
+            print('probe persons = {}, days = {}'.format(persons, days))
+            probes[(persons, days)] = solveResourcePlanning(persons, days, num_of_unit, maxAnnealingCount,
+                                                            numIterationPerTemperature, randomSeed,
+                                                            warmStartExpression(persons, days))
+        return probes[(persons, days)]["bestShapes"] is not None
+
+    SlicingTreeSolutionCache.reset()
+    SubtreeShapeCache.reset()
+    SoftModuleInfo.setSweepBounds(high_persons, maximum_days)
+    try:
+        minimumPersons = _bisectMinimumFeasible(low_persons, high_persons,
+                                                lambda persons: isFeasible(persons, maximum_days))
+        minimumDays = None
+        if minimumPersons is not None:
+            minimumDays = maximum_days
+            if low_days is not None:
+                minimumDays = _bisectMinimumFeasible(low_days, maximum_days,
+                                                     lambda days: isFeasible(minimumPersons, days))
+    finally:
+        SoftModuleInfo.clearSweepBounds()
+    return minimumPersons, minimumDays, probes
+
+
 if __name__ == "__main__":
     num_of_random_trials = 3
     possible_workers = [6 + 3 * i for i in range(0, 12)]
-    worker_bestSolutions_dic = {}
-    found = False
-    for workers in possible_workers:
-        worker_bestSolutions_dic[workers] = []
-        print('workers = ', workers)
-        for trial in range(num_of_random_trials):
-            print('trial = ', trial)
-            bestSolution, pngFileName = ResourcePlanning(maximmum_persons=workers, maximum_days=40, num_of_unit=3,
-                                                         maxAnnealingCount=100, numIterationPerTemperature=100)
-            if not bestSolution is None:
-                worker_bestSolutions_dic[workers].append(bestSolution)
-        if len(worker_bestSolutions_dic[workers]) > 0:
-            print('found')
-            found = True
-            break
-    if found:
-        print('the minimum works  = ', workers)
\ No newline at end of file
+    minimumWorkers, worker_bestSolutions_dic = ResourcePlanningSweep(possible_workers, num_of_random_trials,
+                                                                     maximum_days=40, num_of_unit=3,
+                                                                     maxAnnealingCount=100,
+                                                                     numIterationPerTemperature=100)
+    if minimumWorkers is not None:
+        print('the minimum works  = ', minimumWorkers)
@@ -1,14 +1,75 @@
+import numpy as np
+from Parameters import Parameters
+
 
 class SLIV:
 
-    allowedSLIVs = None
+    allowedSLIVs = None  # (start, length) pairs, None: every pair is allowed
+
+    # compiled from allowedSLIVs on first use after it changes, see _compile()
+    _compiledFrom = None
+    _allowedSet = frozenset()
+    _allowedMask = np.zeros((0, 0), dtype=bool)  # [length, start] -> allowed
+
+    @staticmethod
+    def setAllowedSLIVs(allowedSLIVs):
+        SLIV.allowedSLIVs = None if allowedSLIVs is None else [tuple(sliv) for sliv in allowedSLIVs]
+        SLIV._compile()
+
+    @staticmethod
+    def _compile():
+        # also picks up a list assigned to allowedSLIVs directly
+        if SLIV._compiledFrom is SLIV.allowedSLIVs:
+            return
+        allowedSet = frozenset([(int(start), int(length)) for (start, length) in SLIV.allowedSLIVs])
+        maxStart = max([start for (start, length) in allowedSet], default=-1)
+        maxLength = max([length for (start, length) in allowedSet], default=-1)
+        allowedMask = np.zeros((maxLength + 1, maxStart + 1), dtype=bool)
+        for (start, length) in allowedSet:
+            if start >= 0 and length >= 0:
+                allowedMask[length, start] = True
+        SLIV._allowedSet = allowedSet
+        SLIV._allowedMask = allowedMask
+        SLIV._compiledFrom = SLIV.allowedSLIVs
+
+    @staticmethod
+    def isUnrestricted():
+        return SLIV.allowedSLIVs is None
 
     @staticmethod
     def isAllowedSLIV(S, L):
         if SLIV.allowedSLIVs is None:
             return True
+        SLIV._compile()
+        return (S, L) in SLIV._allowedSet
+
+    @staticmethod
+    def allowedMaskOf(starts, lengths):
+        # element-wise isAllowedSLIV over arrays of the same shape
+        starts = np.asarray(starts, dtype=np.int64)
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if SLIV.allowedSLIVs is None:
+            return np.ones(starts.shape, dtype=bool)
+        SLIV._compile()
+        (numOfLengths, numOfStarts) = SLIV._allowedMask.shape
+        inRange = (starts >= 0) & (starts < numOfStarts) & (lengths >= 0) & (lengths < numOfLengths)
+        allowed = np.zeros(starts.shape, dtype=bool)
+        allowed[inRange] = SLIV._allowedMask[lengths[inRange], starts[inRange]]
+        return allowed
 
-        for sliv in SLIV.allowedSLIVs:
-            if sliv == (S, L):
-                return True
-        return False
+    @staticmethod
+    def allowedShapes(shapes, widthOf):
+        # The shapes whose every (start, width) placement is allowed; widthOf maps a shape id to the task width.
+        # Batches of minShapeCombinationsToVectorize placements or more are checked in one pass over the mask.
+        if SLIV.allowedSLIVs is None or len(shapes) == 0:
+            return shapes
+        numOfTasks = len(shapes[0]["s"])  # all shapes of a node place the same tasks
+        if len(shapes) * numOfTasks < Parameters.minShapeCombinationsToVectorize:
+            SLIV._compile()
+            allowedSet = SLIV._allowedSet
+            return [shape for shape in shapes
+                    if all([(start, widthOf[id]) in allowedSet for (start, id) in zip(shape["s"], shape["id"])])]
+        starts = np.array([shape["s"] for shape in shapes], dtype=np.int64)
+        widths = np.array([[widthOf[id] for id in shape["id"]] for shape in shapes], dtype=np.int64)
+        allowed = SLIV.allowedMaskOf(starts, widths).all(axis=1)
+        return [shape for (shape, isAllowed) in zip(shapes, allowed) if isAllowed]
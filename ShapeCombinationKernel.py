@@ -0,0 +1,106 @@
+import numpy as np
+from NodeTag import NodeTag
+from Parameters import Parameters
+
+
+class ShapeCombinationKernel:
+
+    @staticmethod
+    def toArrays(shapes):
+        numOfShapes = len(shapes)
+        arrays = dict()
+        for key in ("n", "w", "h", "d"):
+            arrays[key] = np.fromiter((shape[key] for shape in shapes), dtype=np.int64, count=numOfShapes)
+        arrays["wd"] = np.fromiter((shape["wd"] for shape in shapes), dtype=np.float64, count=numOfShapes)
+        arrays["smin"] = np.fromiter((min(shape["s"]) for shape in shapes), dtype=np.int64, count=numOfShapes)
+        arrays["fmin"] = np.fromiter((min(shape["f"]) for shape in shapes), dtype=np.int64, count=numOfShapes)
+        return arrays
+
+    @staticmethod
+    def combine(tag, leftShapes, rightShapes, Hmax, Wmax, rightWeight):
+        # All left x right combinations in left-major order, as the nested loops did, restricted to those fitting
+        # into Hmax (F) or Wmax (T). Returns the left/right shape indices and the n/w/h/d/wd of each kept combination.
+        # rightWeight is the total task weight of the right subtree: T shifts the right start days by the left
+        # extent, which adds shift * rightWeight to the weighted delay; F shifts no start day.
+        if len(leftShapes) * len(rightShapes) < Parameters.minShapeCombinationsToVectorize:
+            return ShapeCombinationKernel._combineScalar(tag, leftShapes, rightShapes, Hmax, Wmax, rightWeight)
+        leftArrays = ShapeCombinationKernel.toArrays(leftShapes)
+        rightArrays = ShapeCombinationKernel.toArrays(rightShapes)
+        numOfLeft = len(leftShapes)
+        numOfRight = len(rightShapes)
+        left = np.repeat(np.arange(numOfLeft), numOfRight)
+        right = np.tile(np.arange(numOfRight), numOfLeft)
+        if NodeTag.isF(tag):
+            assert(ShapeCombinationKernel._isSameStart(leftArrays["smin"], rightArrays["smin"]))
+            assert(ShapeCombinationKernel._isSameStart(leftArrays["fmin"], rightArrays["fmin"]))
+            h = leftArrays["h"][left] + rightArrays["h"][right]
+            kept = h <= Hmax
+            left = left[kept]
+            right = right[kept]
+            w = np.maximum(leftArrays["w"][left], rightArrays["w"][right])
+            h = h[kept]
+            d = leftArrays["d"][left] + rightArrays["d"][right]
+            wd = leftArrays["wd"][left] + rightArrays["wd"][right]
+        elif NodeTag.isT(tag):
+            assert(ShapeCombinationKernel._isSameStart(leftArrays["smin"], rightArrays["smin"]))
+            w = leftArrays["w"][left] + rightArrays["w"][right]
+            kept = w <= Wmax
+            left = left[kept]
+            right = right[kept]
+            w = w[kept]
+            h = np.maximum(leftArrays["h"][left], rightArrays["h"][right])
+            d = leftArrays["d"][left] + leftArrays["w"][left] * rightArrays["n"][right] + rightArrays["d"][right]
+            startOfRight = leftArrays["smin"][left] + leftArrays["w"][left]
+            wd = leftArrays["wd"][left] + rightArrays["wd"][right] + startOfRight * rightWeight
+        else:
+            raise ValueError("{} is not a valid operator.".format(tag))
+        n = leftArrays["n"][left] + rightArrays["n"][right]
+        return {"left": left.tolist(), "right": right.tolist(), "n": n.tolist(), "w": w.tolist(), "h": h.tolist(),
+                "d": d.tolist(), "wd": wd.tolist()}
+
+    @staticmethod
+    def _combineScalar(tag, leftShapes, rightShapes, Hmax, Wmax, rightWeight):
+        # same as combine(), for products too small to amortize the NumPy call overhead
+        combination = {"left": [], "right": [], "n": [], "w": [], "h": [], "d": [], "wd": []}
+        isF = NodeTag.isF(tag)
+        if not isF and not NodeTag.isT(tag):
+            raise ValueError("{} is not a valid operator.".format(tag))
+        for (leftIndex, left) in enumerate(leftShapes):
+            for (rightIndex, right) in enumerate(rightShapes):
+                assert(min(left["s"]) == min(right["s"]))
+                if isF:
+                    assert(min(left["f"]) == min(right["f"]))
+                    h = left["h"] + right["h"]
+                    if h > Hmax:
+                        continue
+                    w = max(left["w"], right["w"])
+                    d = left["d"] + right["d"]
+                    wd = left["wd"] + right["wd"]
+                else:
+                    w = left["w"] + right["w"]
+                    if w > Wmax:
+                        continue
+                    h = max(left["h"], right["h"])
+                    d = left["d"] + left["w"] * right["n"] + right["d"]
+                    wd = left["wd"] + right["wd"] + (min(left["s"]) + left["w"]) * rightWeight
+                combination["left"].append(leftIndex)
+                combination["right"].append(rightIndex)
+                combination["n"].append(left["n"] + right["n"])
+                combination["w"].append(w)
+                combination["h"].append(h)
+                combination["d"].append(d)
+                combination["wd"].append(wd)
+        return combination
+
+    @staticmethod
+    def sortOrder(costs):
+        # stable, so that equal costs keep the combination order
+        if len(costs) < Parameters.minShapeCombinationsToVectorize:
+            return sorted(range(len(costs)), key=costs.__getitem__)
+        return np.argsort(costs, kind='stable').tolist()
+
+    @staticmethod
+    def _isSameStart(leftStarts, rightStarts):
+        if len(leftStarts) == 0 or len(rightStarts) == 0:
+            return True
+        return bool((leftStarts == leftStarts[0]).all() and (rightStarts == leftStarts[0]).all())
@@ -0,0 +1,37 @@
+from Parameters import Parameters
+
+
+class FrozenShape(dict):
+    # A shape dict that refuses to be modified, used when Parameters.toVerifyShapeImmutability is set to catch
+    # code writing into a shape that other trees, caches or the simulator may share.
+
+    def _readOnly(self, *args, **kwargs):
+        raise TypeError("shapes are shared between trees and caches and must not be modified")
+
+    __setitem__ = _readOnly
+    __delitem__ = _readOnly
+    clear = _readOnly
+    pop = _readOnly
+    popitem = _readOnly
+    setdefault = _readOnly
+    update = _readOnly
+
+    def __reduce__(self):
+        return FrozenShape, (dict(self), )
+
+
+class ShapeRecord:
+    # Shapes are never modified once built: the per-task sequences s, f and id are tuples, and a shape is shared
+    # by reference instead of being copied.
+
+    @staticmethod
+    def make(n, w, h, d, wd, s, f, id):
+        shape = {"n": n, "w": w, "h": h, "d": d, "wd": wd, "s": s, "f": f, "id": id}
+        if Parameters.toVerifyShapeImmutability:
+            return FrozenShape(shape)
+        return shape
+
+    @staticmethod
+    def freeze(shape):
+        return ShapeRecord.make(shape["n"], shape["w"], shape["h"], shape["d"], shape["wd"],
+                                tuple(shape["s"]), tuple(shape["f"]), tuple(shape["id"]))
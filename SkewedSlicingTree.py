@@ -4,6 +4,9 @@ from InternalNode import InternalNode
 from collections import deque
 from SlicingTreeSolutionCache import SlicingTreeSolutionCache
 from Parameters import Parameters
+from TreeHash import TreeHash
+from PrecedenceConstraints import PrecedenceConstraints
+from PhaseProfiler import PhaseProfiler
 
 import statistics
 import math
@@ -15,22 +18,11 @@ class SkewedSlicingTree:
 
     @staticmethod
     def fullExpression(tree):
-        return tree.getExpression()
+        return tree.getExpression().toKey()
 
     @staticmethod
     def compactFInTree(tree):
-        treeRoot = tree.root()
-        (isLeaf, compactTreeRoot) = SkewedSlicingTree.compactF(treeRoot)
-        postTreeExpression = []
-
-        def appendTag(tag):
-            postTreeExpression.append(tag)
-
-        if isLeaf:
-            return tuple(compactTreeRoot.nodeTag)
-        else:
-            compactTreeRoot.postTraversal(appendTag)
-            return tuple(postTreeExpression)
+        return TreeHash.compactF(tree.getExpression())
 
     @staticmethod
     def compactF(node):
@@ -56,8 +48,8 @@ class SkewedSlicingTree:
         if solutionDict is None:
             return 'no-solution'
         return "n{}w{}h{}d{}wd{}s:{}f:{}id:{}".format(solutionDict["n"], solutionDict["w"], solutionDict["h"], solutionDict["d"], solutionDict["wd"],
-                                          ''.join(str(solutionDict["s"])),
-                                          ''.join(str(solutionDict["f"])),
+                                          ''.join(str(list(solutionDict["s"]))),
+                                          ''.join(str(list(solutionDict["f"]))),
                                           ','.join(solutionDict["id"]))
 
     class TreeNodeStack:
@@ -80,6 +72,7 @@ class SkewedSlicingTree:
         self._bestShapeSolution = None
         self._solvable = False
         self._hitCache = False
+        self._evaluated = False
         self._numOfPendingT = 0
 
     def getExpression(self):
@@ -89,47 +82,7 @@ class SkewedSlicingTree:
         self.evaluate()
         if not self.isSolvable():
             return False
-
-        num_of_task = self._bestShapeSolution["n"]
-        task_id_pos = {}
-        for task_id in range(num_of_task):
-            id = "{}-0".format(task_id)
-            task_id_pos[task_id] = self._bestShapeSolution['id'].index(id)
-
-        # calculate the completion time of the task
-        start_days = self._bestShapeSolution["s"]
-        completion_days = start_days.copy()
-
-        for task_id in range(num_of_task):
-            start = start_days[task_id_pos[task_id]]
-            shape = SoftModuleInfo.getShapeInfoById(self._bestShapeSolution['id'][task_id_pos[task_id]])
-            day = shape["w"]
-            completion_days[task_id_pos[task_id]] += day
-
-        # Task 0 needs to complete before the Task 0 on the next unit.
-        for task_id in range(0, num_of_task, 4):
-
-            start_day = start_days[task_id_pos[task_id]]
-            complete_day = completion_days[task_id_pos[task_id]]
-            for task_id_other in range(0, num_of_task, 4):
-                if task_id == task_id_other:
-                    continue
-                start_day_other = start_days[task_id_pos[task_id_other]]
-                if start_day_other >= start_day and start_day_other < complete_day: # confliction between Task0 of different units
-                    return False
-
-        # Task 0 needs to be completed before Task 1, Task 2, and Task 3 in the same unit.
-        num_of_unit = num_of_task // 4
-        for unit in range(num_of_unit):
-            start_days_within_unit = [start_days[task_id_pos[4 * unit + i]] for i in range(4)]
-            complete_days_task_0 = completion_days[task_id_pos[4 * unit]]
-            for task_in_unit in range(1, 4):
-                start_day_other_task = start_days_within_unit[task_in_unit]
-                if start_day_other_task < complete_days_task_0:
-                    return False
-
-        return True
-
+        return PrecedenceConstraints.active().isSatisfiedBy(self._bestShapeSolution)
 
     def satisfyFeatureSpecificConstraints(self, constrain):
         if constrain == Parameters.FeatureConstrains.ENoConstrain:
@@ -212,26 +165,56 @@ class SkewedSlicingTree:
         else:
             return self._root.getNumOfShapeToEvaluate()
 
+    @staticmethod
+    def bestShapeWithinBounds(front, Hmax, Wmax):
+        # the front is sorted by cost, so the first shape that fits is the best one at this capacity
+        for shape in front:
+            if shape["h"] <= Hmax and shape["w"] <= Wmax:
+                return shape
+        return None
+
     def evaluate(self):
-        treeExpression = SkewedSlicingTree.fullExpression(self)
+        if self._evaluated:  # e.g. already evaluated by the constraint check
+            return
+        self._evaluated = True
+        profiling = Parameters.toProfilePhases
+        if profiling:
+            PhaseProfiler.start("evaluate")
+            PhaseProfiler.count("treeEvaluations")
+        treeExpression = TreeHash.hash(self)  # key type selected by Parameters.slicingTreeExpressionKeyType
+        isSweepMode = SoftModuleInfo.isSweepMode()
+        if isSweepMode:  # the root front under the sweep bounds is cached, and filtered for this capacity
+            treeExpression = (treeExpression, SoftModuleInfo.evaluationHmax(), SoftModuleInfo.evaluationWmax())
         (cached, cachedSolution) = SlicingTreeSolutionCache.fetchCache(treeExpression)
         if not cached:
             self._hitCache = False
             ShapeSolutions = self._root.evaluateShapes()
-            if len(ShapeSolutions) > 0:
-                self._solvable = True
+            if isSweepMode:
+                cachedSolution = tuple(ShapeSolutions)
+                self._bestShapeSolution = SkewedSlicingTree.bestShapeWithinBounds(cachedSolution, SoftModuleInfo.Hmax,
+                                                                                  SoftModuleInfo.Wmax)
+            elif len(ShapeSolutions) > 0:
                 self._bestShapeSolution = ShapeSolutions[0]
+                cachedSolution = self._bestShapeSolution
             else:
-                self._solvable = False
                 self._bestShapeSolution = None
-            SlicingTreeSolutionCache.addCache(treeExpression, self._bestShapeSolution)
+                cachedSolution = None
+            self._solvable = self._bestShapeSolution is not None
+            SlicingTreeSolutionCache.addCache(treeExpression, cachedSolution)
         else:
             self._hitCache = True
             # print('HIT Cache {}'.format(SlicingTreeSolutionCache.hitCachedCount))
             SlicingTreeSolutionCache.hitCachedCount = SlicingTreeSolutionCache.hitCachedCount + 1
-            self._bestShapeSolution = cachedSolution
-            if self._bestShapeSolution is None:
-                self._solvable = False
+            if profiling:
+                PhaseProfiler.count("solutionCacheHits")
+            if isSweepMode:
+                self._bestShapeSolution = SkewedSlicingTree.bestShapeWithinBounds(cachedSolution, SoftModuleInfo.Hmax,
+                                                                                  SoftModuleInfo.Wmax)
+            else:
+                self._bestShapeSolution = cachedSolution
+            self._solvable = self._bestShapeSolution is not None
+        if profiling:
+            PhaseProfiler.stop()
 
     def print(self):
         def printFollowedByComma(x):
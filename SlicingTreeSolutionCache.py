@@ -1,29 +1,78 @@
+from collections import OrderedDict
+from Parameters import Parameters
+import sys
+
 
 class SlicingTreeSolutionCache:
 
-    solutionCache = {}
+    # expression key -> best shape solution, or (expression key, sweep bounds) -> Pareto front tuple in sweep mode,
+    # ordered from least to most recently used
+    solutionCache = OrderedDict()
     hitCachedCount = 0
+    evictedCount = 0
+    cacheBytes = 0
 
     @staticmethod
     def reset():
-        SlicingTreeSolutionCache.solutionCache = {}
+        SlicingTreeSolutionCache.solutionCache = OrderedDict()
         SlicingTreeSolutionCache.hitCachedCount = 0
+        SlicingTreeSolutionCache.evictedCount = 0
+        SlicingTreeSolutionCache.cacheBytes = 0
 
     @staticmethod
     def cacheSize():
         return len(SlicingTreeSolutionCache.solutionCache)
 
     @staticmethod
-    def addCache(expression, solution):
-        SlicingTreeSolutionCache.solutionCache[expression] = solution
+    def _estimateShapeBytes(shape):
+        return sys.getsizeof(shape) + sum([sys.getsizeof(value) for value in shape.values()])
+
+    @staticmethod
+    def estimateEntryBytes(expressionKey, solution):
+        # rough footprint of one entry: the key plus the solution dict(s) and their top level values
+        size = sys.getsizeof(expressionKey)
+        if isinstance(solution, tuple):  # a whole front, shapes shared with the subtree memo are counted again
+            size = size + sys.getsizeof(solution) + sum([SlicingTreeSolutionCache._estimateShapeBytes(shape)
+                                                         for shape in solution])
+        elif solution is not None:
+            size = size + SlicingTreeSolutionCache._estimateShapeBytes(solution)
+        return size
+
+    @staticmethod
+    def _isOverBudget():
+        maxEntries = Parameters.solutionCacheMaxEntries
+        maxBytes = Parameters.solutionCacheMaxBytes
+        if maxEntries is not None and len(SlicingTreeSolutionCache.solutionCache) > maxEntries:
+            return True
+        if maxBytes is not None and SlicingTreeSolutionCache.cacheBytes > maxBytes:
+            return True
+        return False
 
     @staticmethod
-    def fetchCache(expression):
+    def _evictLeastRecentlyUsed():
+        while len(SlicingTreeSolutionCache.solutionCache) > 0 and SlicingTreeSolutionCache._isOverBudget():
+            (expressionKey, solution) = SlicingTreeSolutionCache.solutionCache.popitem(last=False)
+            SlicingTreeSolutionCache.cacheBytes -= SlicingTreeSolutionCache.estimateEntryBytes(expressionKey, solution)
+            SlicingTreeSolutionCache.evictedCount = SlicingTreeSolutionCache.evictedCount + 1
+
+    @staticmethod
+    def addCache(expressionKey, solution):  # expressionKey must be hashable and immutable, e.g. a tuple
+        cache = SlicingTreeSolutionCache.solutionCache
+        if expressionKey in cache:
+            SlicingTreeSolutionCache.cacheBytes -= SlicingTreeSolutionCache.estimateEntryBytes(expressionKey,
+                                                                                             cache[expressionKey])
+        cache[expressionKey] = solution
+        cache.move_to_end(expressionKey)
+        SlicingTreeSolutionCache.cacheBytes += SlicingTreeSolutionCache.estimateEntryBytes(expressionKey, solution)
+        SlicingTreeSolutionCache._evictLeastRecentlyUsed()
+
+    @staticmethod
+    def fetchCache(expressionKey):
         defaultValueIfNotExisting = False
-        cached = SlicingTreeSolutionCache.solutionCache.get(expression, defaultValueIfNotExisting)
+        cached = SlicingTreeSolutionCache.solutionCache.get(expressionKey, defaultValueIfNotExisting)
         if cached is defaultValueIfNotExisting:
             return False, None
         else:
+            SlicingTreeSolutionCache.solutionCache.move_to_end(expressionKey)
             return True, cached
 
-
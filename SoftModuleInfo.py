@@ -1,4 +1,6 @@
 import sys
+import numpy as np
+from ShapeRecord import ShapeRecord
 
 class SoftModuleInfo:
     infoMap = []
@@ -6,7 +8,24 @@ class SoftModuleInfo:
     Hmax = 100
     Wmax = 12
 
+    # loosest bounds of a capacity sweep, None outside a sweep. While they are set, shapes are combined and pruned
+    # against them instead of Hmax/Wmax, so a Pareto front serves every capacity of the sweep.
+    sweepHmax = None
+    sweepWmax = None
+
     allPossibleShapes = None
+    precedenceConstraints = None  # PrecedenceConstraints of the tasks, None: the default per-unit template
+
+    # shape catalog, rebuilt from infoMap and ueWeights by _buildShapeCatalog()
+    shapeById = {}  # shape id "task-shape" -> shape info
+    shapeIndexById = {}  # shape id -> dense shape index
+    taskIdById = {}  # shape id -> task id, so that hot paths never split the id string
+    shapeWidthById = {}  # shape id -> w
+    shapeIds = []  # dense shape index -> shape id
+    shapeWidths = np.zeros(0, dtype=np.int64)
+    shapeHeights = np.zeros(0, dtype=np.int64)
+    shapeWeights = np.zeros(0, dtype=np.float64)  # nan if the task has no weight yet
+    shapeTaskIds = np.zeros(0, dtype=np.int64)
 
     @staticmethod
     def setHmax(H):
@@ -16,26 +35,116 @@ class SoftModuleInfo:
     def setWmax(W):
         SoftModuleInfo.Wmax = W
 
+    @staticmethod
+    def setSweepBounds(H, W):
+        SoftModuleInfo.sweepHmax = H
+        SoftModuleInfo.sweepWmax = W
+
+    @staticmethod
+    def clearSweepBounds():
+        SoftModuleInfo.sweepHmax = None
+        SoftModuleInfo.sweepWmax = None
+
+    @staticmethod
+    def isSweepMode():
+        return SoftModuleInfo.sweepHmax is not None
+
+    @staticmethod
+    def evaluationHmax():  # bound that fronts are evaluated against, never tighter than Hmax
+        if SoftModuleInfo.sweepHmax is None:
+            return SoftModuleInfo.Hmax
+        return max(SoftModuleInfo.sweepHmax, SoftModuleInfo.Hmax)
+
+    @staticmethod
+    def evaluationWmax():
+        if SoftModuleInfo.sweepWmax is None:
+            return SoftModuleInfo.Wmax
+        return max(SoftModuleInfo.sweepWmax, SoftModuleInfo.Wmax)
+
     @staticmethod
     def setInfoMap(infoMap):
-        SoftModuleInfo.infoMap = infoMap
+        SoftModuleInfo.infoMap = [[ShapeRecord.freeze(shapeInfo) for shapeInfo in moduleInfo] for moduleInfo in infoMap]
+        SoftModuleInfo._buildShapeCatalog()
 
     @staticmethod
     def setUeWeights(ueWeights):
         SoftModuleInfo.ueWeights = ueWeights
+        SoftModuleInfo._buildShapeCatalog()
 
     @staticmethod
-    def getModuleInfoByTag(tag):
-        return SoftModuleInfo.infoMap[tag]
+    def setPrecedenceConstraints(precedenceConstraints):
+        SoftModuleInfo.precedenceConstraints = precedenceConstraints
 
     @staticmethod
-    def getShapeInfoById(id):
+    def _withLeafWeightedDelay(shapeInfo, weight):
+        # a single task placed at s[0] completes at s[0] + w; combined shapes add their children's wd on this
+        weightedDelay = weight * (shapeInfo["s"][0] + shapeInfo["w"])
+        if shapeInfo["wd"] == weightedDelay:
+            return shapeInfo
+        return ShapeRecord.make(shapeInfo["n"], shapeInfo["w"], shapeInfo["h"], shapeInfo["d"], weightedDelay,
+                                shapeInfo["s"], shapeInfo["f"], shapeInfo["id"])
+
+    @staticmethod
+    def _buildShapeCatalog():
+        shapeById = {}
+        shapeIndexById = {}
+        taskIdById = {}
+        shapeWidthById = {}
+        shapeIds = []
+        widths = []
+        heights = []
+        weights = []
+        taskIds = []
+        infoMap = []
         for moduleInfo in SoftModuleInfo.infoMap:
+            moduleShapes = []
+            infoMap.append(moduleShapes)
             for shapeInfo in moduleInfo:
                 assert(len(shapeInfo["id"]) == 1)
-                if shapeInfo["id"][0] == id:
-                    return shapeInfo
-        return None
+                assert(len(shapeInfo["s"]) == 1)
+                id = shapeInfo["id"][0]
+                taskId = int(id.split("-")[0])
+                if taskId in SoftModuleInfo.ueWeights:
+                    shapeInfo = SoftModuleInfo._withLeafWeightedDelay(shapeInfo, SoftModuleInfo.ueWeights[taskId])
+                moduleShapes.append(shapeInfo)
+                if id in shapeById:  # keep the first match, as the former linear scan did
+                    continue
+                shapeById[id] = shapeInfo
+                shapeIndexById[id] = len(shapeIds)
+                taskIdById[id] = taskId
+                shapeWidthById[id] = shapeInfo["w"]
+                shapeIds.append(id)
+                widths.append(shapeInfo["w"])
+                heights.append(shapeInfo["h"])
+                weights.append(SoftModuleInfo.ueWeights.get(taskId, np.nan))
+                taskIds.append(taskId)
+
+        SoftModuleInfo.infoMap = infoMap
+        SoftModuleInfo.shapeById = shapeById
+        SoftModuleInfo.shapeIndexById = shapeIndexById
+        SoftModuleInfo.taskIdById = taskIdById
+        SoftModuleInfo.shapeWidthById = shapeWidthById
+        SoftModuleInfo.shapeIds = shapeIds
+        SoftModuleInfo.shapeWidths = np.array(widths, dtype=np.int64)
+        SoftModuleInfo.shapeHeights = np.array(heights, dtype=np.int64)
+        SoftModuleInfo.shapeWeights = np.array(weights, dtype=np.float64)
+        SoftModuleInfo.shapeTaskIds = np.array(taskIds, dtype=np.int64)
+
+    @staticmethod
+    def getModuleInfoByTag(tag):
+        return SoftModuleInfo.infoMap[tag]
+
+    @staticmethod
+    def getShapeInfoById(id):
+        return SoftModuleInfo.shapeById.get(id)
+
+    @staticmethod
+    def getShapeIndexById(id):
+        return SoftModuleInfo.shapeIndexById[id]
+
+    @staticmethod
+    def getTaskIdById(id):
+        return SoftModuleInfo.taskIdById[id]
 
     @staticmethod
     def getInfoMapLog():
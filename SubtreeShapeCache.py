@@ -0,0 +1,62 @@
+from collections import OrderedDict
+from Parameters import Parameters
+
+
+class SubtreeShapeCache:
+
+    # Each distinct subtree (postfix signature) is interned to an integer id when the tree is built, so that a
+    # subtree key is computed in O(1) from its children's ids instead of re-walking the subtree.
+    signatureIds = {}  # (tag,) for a leaf or (tag, leftSignatureId, rightSignatureId) -> signature id
+    nextSignatureId = 0  # never reused, so ids held by still-alive trees cannot alias a later signature
+    shapeCache = OrderedDict()  # (signature id, Hmax, Wmax, start pos fixed, cost) -> pruned shapes, LRU ordered
+    hitCount = 0
+    missCount = 0
+
+    @staticmethod
+    def reset():
+        SubtreeShapeCache.signatureIds = {}
+        SubtreeShapeCache.shapeCache = OrderedDict()
+        SubtreeShapeCache.hitCount = 0
+        SubtreeShapeCache.missCount = 0
+
+    @staticmethod
+    def cacheSize():
+        return len(SubtreeShapeCache.shapeCache)
+
+    @staticmethod
+    def signatureIdOf(tag, leftSignatureId=None, rightSignatureId=None):
+        if leftSignatureId is None:
+            signature = (tag, )
+        else:
+            signature = (tag, leftSignatureId, rightSignatureId)
+        signatureId = SubtreeShapeCache.signatureIds.get(signature)
+        if signatureId is None:
+            maxSignatures = Parameters.subtreeSignatureMaxEntries
+            if maxSignatures is not None and len(SubtreeShapeCache.signatureIds) >= maxSignatures:
+                # cached shapes are keyed by the forgotten ids, so they are unreachable from now on
+                SubtreeShapeCache.signatureIds = {}
+                SubtreeShapeCache.shapeCache = OrderedDict()
+            signatureId = SubtreeShapeCache.nextSignatureId
+            SubtreeShapeCache.nextSignatureId = SubtreeShapeCache.nextSignatureId + 1
+            SubtreeShapeCache.signatureIds[signature] = signatureId
+        return signatureId
+
+    @staticmethod
+    def addCache(key, shapes):
+        cache = SubtreeShapeCache.shapeCache
+        cache[key] = shapes
+        cache.move_to_end(key)
+        maxEntries = Parameters.subtreeShapeCacheMaxEntries
+        while maxEntries is not None and len(cache) > maxEntries:
+            cache.popitem(last=False)
+
+    @staticmethod
+    def fetchCache(key):
+        shapes = SubtreeShapeCache.shapeCache.get(key)
+        if shapes is None:
+            SubtreeShapeCache.missCount = SubtreeShapeCache.missCount + 1
+            return False, None
+        else:
+            SubtreeShapeCache.hitCount = SubtreeShapeCache.hitCount + 1
+            SubtreeShapeCache.shapeCache.move_to_end(key)
+            return True, shapes
@@ -0,0 +1,75 @@
+import enum
+import json
+import math
+import numpy as np
+
+
+class TraceEventSink:
+    # Receives one event per annealing iteration, as plain values in the order of `fields`, so that recording
+    # costs no string formatting. Subclasses decide where the events go.
+
+    class Outcome(enum.Enum):
+        Accepted = 0  # solvable neighbor, downhill or uphill accepted by the Metropolis rule
+        Rejected = 1  # solvable neighbor rejected by the Metropolis rule
+        UnsolvableAccepted = 2
+        UnsolvableRejected = 3
+        InvalidAccepted = 4  # neighbor violating the feature constraints
+        InvalidRejected = 5
+
+    fields = ("annealingCount", "iteration", "operation", "index", "outcome", "hitCache", "neighborDelay",
+              "currentDelay", "minimumDelay", "temperature")
+
+    def record(self, annealingCount, iteration, operation, index, outcome, hitCache, neighborDelay, currentDelay,
+               minimumDelay, temperature):
+        pass
+
+    def close(self):
+        pass
+
+
+class TraceRingBuffer(TraceEventSink):
+    # keeps the last `capacity` events in a preallocated structured array
+
+    dtype = np.dtype([("annealingCount", np.int32), ("iteration", np.int32), ("operation", np.int8),
+                      ("index", np.int32), ("outcome", np.int8), ("hitCache", np.bool_), ("neighborDelay", np.float64),
+                      ("currentDelay", np.float64), ("minimumDelay", np.float64), ("temperature", np.float64)])
+
+    def __init__(self, capacity=100000):
+        self._events = np.zeros(capacity, dtype=TraceRingBuffer.dtype)
+        self._numOfRecorded = 0
+
+    def record(self, annealingCount, iteration, operation, index, outcome, hitCache, neighborDelay, currentDelay,
+               minimumDelay, temperature):
+        self._events[self._numOfRecorded % len(self._events)] = (annealingCount, iteration, operation, index, outcome,
+                                                                 hitCache, neighborDelay, currentDelay, minimumDelay,
+                                                                 temperature)
+        self._numOfRecorded = self._numOfRecorded + 1
+
+    def numOfRecorded(self):
+        return self._numOfRecorded
+
+    def events(self):
+        # the kept events, oldest first
+        capacity = len(self._events)
+        if self._numOfRecorded <= capacity:
+            return self._events[:self._numOfRecorded].copy()
+        position = self._numOfRecorded % capacity
+        return np.concatenate((self._events[position:], self._events[:position]))
+
+
+class JsonlTraceSink(TraceEventSink):
+    # appends one JSON object per event to a file
+
+    def __init__(self, path):
+        self._file = open(path, "a")
+
+    def record(self, annealingCount, iteration, operation, index, outcome, hitCache, neighborDelay, currentDelay,
+               minimumDelay, temperature):
+        values = (annealingCount, iteration, operation, index, outcome, hitCache, neighborDelay, currentDelay,
+                  minimumDelay, temperature)
+        event = {field: (None if isinstance(value, float) and not math.isfinite(value) else value)
+                 for (field, value) in zip(TraceEventSink.fields, values)}
+        self._file.write(json.dumps(event) + "\n")
+
+    def close(self):
+        self._file.close()
@@ -1,24 +1,58 @@
-import enum
-from InternalNode import InternalNode
-from LeafNode import LeafNode
+from collections import deque
 from NodeTag import NodeTag
+from Parameters import Parameters
 
 
 class TreeHash:
 
-    class HashKeyDefinitions(enum.Enum):
-        PerTGroup = 0
-
-
-    hashKeyDefinition = HashKeyDefinitions.PerTGroup
-
+    @staticmethod
+    def hash(tree):
+        if Parameters.slicingTreeExpressionKeyType == Parameters.SlicingTreeExpressionKeyTypes.PostOrderFullForChannelAwared:
+            return tree.getExpression().toKey()
+        return TreeHash.hashExpression(tree.getExpression(), Parameters.slicingTreeExpressionKeyType)
 
+    @staticmethod
+    def hashExpression(expression, keyType):
+        if keyType == Parameters.SlicingTreeExpressionKeyTypes.PostOrderFullForChannelAwared:
+            return tuple(expression)
+        elif keyType == Parameters.SlicingTreeExpressionKeyTypes.CompactFForChannelUnAwared:
+            return TreeHash.compactF(expression)
+        else:
+            raise ValueError("{} is not a valid slicing tree expression key type.".format(keyType))
 
+    @staticmethod
+    def _toPostfix(isLeafGroup, item):
+        if isLeafGroup:
+            return deque([tuple(item)])
+        return item
 
     @staticmethod
-    def hash(tree):
-        if TreeHash.hashKeyDefinition == TreeHash.HashKeyDefinitions.PerTGroup:
-            if NodeTag.isT(tree.root.nodeTag):
-                left = compactF(tree.root.leftNode())
-                right = compactF(tree.root.rightNode())
-                compactTree.root = InternalNode(left, right, compactTree)
\ No newline at end of file
+    def compactF(expression):
+        # Same key as SkewedSlicingTree.compactFInTree, computed in one pass over the postfix expression without
+        # building a tree: an F whose both children are leaves (or F-groups of leaves) collapses into one leaf
+        # group holding the sorted operands, so stacking the same tasks vertically in any order gives one key.
+        stack = []  # items: (isLeafGroup, sorted operand list) or (False, deque of postfix tags)
+        for tag in expression:
+            if NodeTag.isOperand(tag):
+                stack.append((True, [tag]))
+                continue
+            (isRightLeafGroup, right) = stack.pop()
+            (isLeftLeafGroup, left) = stack.pop()
+            if NodeTag.isF(tag) and isLeftLeafGroup and isRightLeafGroup:
+                left.extend(right)
+                left.sort()  # two sorted runs, merged in linear time
+                stack.append((True, left))
+            else:
+                left = TreeHash._toPostfix(isLeftLeafGroup, left)
+                right = TreeHash._toPostfix(isRightLeafGroup, right)
+                if len(left) >= len(right):  # always move the shorter side, so that the pass stays near linear
+                    left.extend(right)
+                    merged = left
+                else:
+                    right.extendleft(reversed(left))
+                    merged = right
+                merged.append(tag)
+                stack.append((False, merged))
+
+        (isLeafGroup, root) = stack.pop()
+        return tuple(root)
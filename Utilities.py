@@ -1,4 +1,5 @@
 from SoftModuleInfo import SoftModuleInfo
+from Parameters import Parameters
 
 def overrides(interface_class):
     def overrider(method):
@@ -8,9 +9,20 @@ def overrides(interface_class):
     return overrider
 
 
-def LOG(info, level=0):
-    if level > 0:
-        print(info)
+def isLogEnabled(level):
+    return level >= Parameters.logLevel
+
+
+def LOG(info, level=0, *args):
+    # info is printed as is, formatted with args, or called first if it is callable, so that below the log level
+    # no message is built; guard with isLogEnabled() where even the arguments are costly to compute
+    if level < Parameters.logLevel:
+        return
+    if callable(info):
+        info = info()
+    elif len(args) > 0:
+        info = info.format(*args)
+    print(info)
 
 
 def getSumQueueingDelay(solution):
@@ -19,8 +31,7 @@ def getSumQueueingDelay(solution):
     shapeIds = bestShapes["id"]
     sumOfDelay = 0
     for (startPos, shapeId) in zip(startPositions, shapeIds):
-        shapeInfo = SoftModuleInfo.getShapeInfoById(shapeId)
-        width = shapeInfo["w"]
+        width = SoftModuleInfo.shapeById[shapeId]["w"]
         sumOfDelay += (startPos + width)
     return sumOfDelay
 
@@ -0,0 +1,64 @@
+import hashlib
+import json
+import sqlite3
+from datetime import datetime
+from SoftModuleInfo import SoftModuleInfo
+from Parameters import Parameters
+from SLIV import SLIV
+from PrecedenceConstraints import PrecedenceConstraints
+
+
+class WarmStartStore:
+    # On-disk record of the best expression found per problem and capacity, so that a later run of the same
+    # problem (e.g. nightly re-planning) starts from the closest known solution instead of the default expression.
+    # A problem is identified by problemFingerprint(); Hmax/Wmax are stored per row, so that one problem can be
+    # looked up at a capacity that was never solved.
+
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path)
+        self._connection.execute("CREATE TABLE IF NOT EXISTS bestExpressions ("
+                                 "fingerprint TEXT NOT NULL, "
+                                 "Hmax INTEGER NOT NULL, "
+                                 "Wmax INTEGER NOT NULL, "
+                                 "expression TEXT NOT NULL, "
+                                 "minimumDelay REAL NOT NULL, "
+                                 "recordedAt TEXT NOT NULL, "
+                                 "PRIMARY KEY (fingerprint, Hmax, Wmax))")
+        self._connection.commit()
+
+    def close(self):
+        self._connection.close()
+
+    @staticmethod
+    def problemFingerprint():
+        # shape catalog, task weights, SLIVs, precedences and the constraint/cost mode of the problem currently loaded
+        problem = {"shapes": [[[shape["id"][0], shape["w"], shape["h"], shape["d"]] for shape in moduleInfo]
+                              for moduleInfo in SoftModuleInfo.infoMap],
+                   "weights": sorted([[str(taskId), weight] for (taskId, weight) in SoftModuleInfo.ueWeights.items()]),
+                   "allowedSLIVs": None if SLIV.allowedSLIVs is None else sorted([list(sliv)
+                                                                                 for sliv in SLIV.allowedSLIVs]),
+                   "precedenceConstraints": PrecedenceConstraints.active().describe(),
+                   "featureConstrain": Parameters.FeatureConstrains(Parameters.featureConstrain).name,
+                   "toUseWeightedDelayAsCost": Parameters.toUseWeightedDelayAsCost}
+        return hashlib.sha1(json.dumps(problem, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def record(self, fingerprint, Hmax, Wmax, expression, minimumDelay):
+        # keeps the better of the stored and the given expression for (fingerprint, Hmax, Wmax)
+        self._connection.execute("INSERT INTO bestExpressions VALUES (?, ?, ?, ?, ?, ?) "
+                                 "ON CONFLICT (fingerprint, Hmax, Wmax) DO UPDATE SET "
+                                 "expression = excluded.expression, minimumDelay = excluded.minimumDelay, "
+                                 "recordedAt = excluded.recordedAt "
+                                 "WHERE excluded.minimumDelay < bestExpressions.minimumDelay",
+                                 (fingerprint, Hmax, Wmax, json.dumps(list(expression)), minimumDelay,
+                                  datetime.now().isoformat()))
+        self._connection.commit()
+
+    def closestExpression(self, fingerprint, Hmax, Wmax):
+        # Best expression of the closest capacity recorded for this problem, or None. Capacities no larger than
+        # (Hmax, Wmax) come first, since their solutions still fit; ties are broken by distance and then by delay.
+        row = self._connection.execute("SELECT expression FROM bestExpressions WHERE fingerprint = ? "
+                                       "ORDER BY (Hmax > ? OR Wmax > ?), ABS(Hmax - ?) + ABS(Wmax - ?), minimumDelay "
+                                       "LIMIT 1", (fingerprint, Hmax, Wmax, Hmax, Wmax)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
@@ -0,0 +1,38 @@
+import enum
+from SoftModuleInfo import SoftModuleInfo
+from Parameters import Parameters
+from SLIV import SLIV
+
+
+class WorkerContext:
+    # The problem definition lives in class attributes (SoftModuleInfo, SLIV, Parameters), which a worker process
+    # does not inherit under the spawn start method. capture() takes a picklable copy of them in the parent and
+    # restore() installs it in the worker, typically as the initializer of a process pool.
+
+    @staticmethod
+    def _parameterNames():
+        return [name for (name, value) in vars(Parameters).items()
+                if not name.startswith('_') and not callable(value) and not isinstance(value, staticmethod)]
+
+    @staticmethod
+    def capture():
+        return {"infoMap": SoftModuleInfo.infoMap,
+                "ueWeights": SoftModuleInfo.ueWeights,
+                "Hmax": SoftModuleInfo.Hmax,
+                "Wmax": SoftModuleInfo.Wmax,
+                "sweepBounds": (SoftModuleInfo.sweepHmax, SoftModuleInfo.sweepWmax),
+                "allowedSLIVs": SLIV.allowedSLIVs,
+                "precedenceConstraints": SoftModuleInfo.precedenceConstraints,
+                "parameters": {name: getattr(Parameters, name) for name in WorkerContext._parameterNames()}}
+
+    @staticmethod
+    def restore(context):
+        for (name, value) in context["parameters"].items():
+            setattr(Parameters, name, value)
+        SLIV.setAllowedSLIVs(context["allowedSLIVs"])
+        SoftModuleInfo.setInfoMap(context["infoMap"])
+        SoftModuleInfo.setUeWeights(context["ueWeights"])
+        SoftModuleInfo.setPrecedenceConstraints(context["precedenceConstraints"])
+        SoftModuleInfo.setHmax(context["Hmax"])
+        SoftModuleInfo.setWmax(context["Wmax"])
+        (SoftModuleInfo.sweepHmax, SoftModuleInfo.sweepWmax) = context["sweepBounds"]